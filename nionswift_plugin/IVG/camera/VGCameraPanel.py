@@ -1,5 +1,6 @@
 import gettext
 import logging
+import threading
 
 from nion.utils import Converter
 from nion.utils import Model
@@ -10,6 +11,44 @@ from nionswift_plugin.IVG.camera import VGCameraYves
 _ = gettext.gettext
 
 
+class StripsToStringConverter:
+    """Converts strips [(first, last + 1), ...] to and from text such as "10-40, 60-90" (last row included)."""
+
+    def convert(self, value):
+        return ", ".join("{0}-{1}".format(start, end - 1) for start, end in value or [])
+
+    def convert_back(self, formatted_value):
+        strips = []
+        for text in formatted_value.replace(";", ",").split(","):
+            if not text.strip():
+                continue
+            try:
+                start, end = (int(bound) for bound in text.split("-"))
+            except ValueError:
+                logging.info('***CAMERA***: Strip %s is not first-last (rows). Ignored.', text.strip())
+                continue
+            strips.append((min(start, end), max(start, end) + 1))
+        return strips
+
+
+class ExposuresToStringConverter:
+    """Converts a list of exposures (ms) to and from text such as "0.1, 1, 10"."""
+
+    def convert(self, value):
+        return ", ".join("{0:g}".format(exposure) for exposure in value or [])
+
+    def convert_back(self, formatted_value):
+        exposures = []
+        for text in formatted_value.replace(";", ",").split(","):
+            if not text.strip():
+                continue
+            try:
+                exposures.append(float(text))
+            except ValueError:
+                logging.info('***CAMERA***: Exposure %s is not a number (ms). Ignored.', text.strip())
+        return exposures
+
+
 class CameraHandler:
     """Handle interaction between the user interface and the hardware.
 
@@ -28,6 +67,7 @@ class CameraHandler:
                  camera_settings: VGCameraYves.CameraSettings):
         self.event_loop = event_loop
         self.ui_view = ui_view
+        self.__api = api
 
         self.hardware_source = api.get_hardware_source_by_id(hardware_source_id, "~1.0")
         self.__hardware_source = self.hardware_source._hardware_source
@@ -92,11 +132,31 @@ class CameraHandler:
         self.threshold_converter = Converter.IntegerToStringConverter()
         self.nbspectra_model = Model.PropertyModel(frame_parameters["spectra_count"])
         self.nbspectra_converter = Converter.IntegerToStringConverter()
+        self.chrono_ring_model = Model.PropertyModel(frame_parameters["chrono_ring"])
+        self.chrono_path_model = Model.PropertyModel(frame_parameters["chrono_path"])
+        self.spim_stream_path_model = Model.PropertyModel(frame_parameters["spim_stream_path"])
+        self.cumul_rejection_items = [_("Camera sum"), _("Sigma clip"), _("Median of k")]
+        self.cumul_rejection_item = Model.PropertyModel(frame_parameters["cumul_rejection"])
+        self.cumul_k_model = Model.PropertyModel(frame_parameters["cumul_k"])
+        self.cumul_k_converter = Converter.IntegerToStringConverter()
+        self.strips_model = Model.PropertyModel(frame_parameters["strips"])
+        self.zlp_align_items = [_("Stack"), _("ZLP centroid"), _("ZLP parabola")]
+        self.zlp_align_item = Model.PropertyModel(frame_parameters["zlp_align"])
+        self.zlp_fourier_model = Model.PropertyModel(frame_parameters["zlp_fourier"])
+        self.hdr_exposures_model = Model.PropertyModel(frame_parameters["hdr_exposures_ms"])
+        self.hdr_exposures_converter = ExposuresToStringConverter()
+        self.storage_items = [_("Float32"), _("UInt16"), _("UInt32")]
+        self.storage_item = Model.PropertyModel(VGCameraYves.STORAGE_DTYPES.index(frame_parameters["storage_dtype"]))
+        self.strips_converter = StripsToStringConverter()
         self.tab_v_binning = Model.PropertyModel(0)
         self.status_text = Model.PropertyModel("Stopped")
-        correction_enum = 0
+        self.target_rate_model = Model.PropertyModel(10.)
+        self.target_rate_converter = Converter.FloatToStringConverter(format="{0:.1f}")
+        self.plan_text = Model.PropertyModel("")
+        correction_enum = frame_parameters["correction"]
         self.correction_items = [_("None"), _("Readout"), _("Gain"), _("Both")]
         self.correction_item = Model.PropertyModel(correction_enum)
+        self.correction_float_model = Model.PropertyModel(frame_parameters["correction_float"])
 
         self.soft_binning_model = Model.PropertyModel(frame_parameters["soft_binning"])
 
@@ -107,6 +167,12 @@ class CameraHandler:
         self.mode_item_text = Model.PropertyModel("???g")
 
         self.tp3mode_item = Model.PropertyModel(frame_parameters["tp3mode"])
+        self.tp3drift_model = Model.PropertyModel(frame_parameters["tp3drift"])
+        self.tp3roi_start_model = Model.PropertyModel(frame_parameters["tp3roi"][0])
+        self.tp3roi_end_model = Model.PropertyModel(frame_parameters["tp3roi"][1])
+        self.tp3bin_model = Model.PropertyModel(frame_parameters["tp3bin"])
+        self.tp3process_model = Model.PropertyModel(frame_parameters["tp3process"])
+        self.tp3_converter = Converter.IntegerToStringConverter()
 
         #def frame_parameter_changed(name, *args, **kwargs):
         #    if name == "acquisition_mode":
@@ -250,6 +316,66 @@ class CameraHandler:
             frame_parameters["spectra_count"] = value
             self.camera_settings.set_current_frame_parameters(frame_parameters)
 
+        def set_chrono_ring(value):
+            frame_parameters = self.camera_settings.get_current_frame_parameters()
+            frame_parameters["chrono_ring"] = value
+            self.camera_settings.set_current_frame_parameters(frame_parameters)
+
+        def set_chrono_path(value):
+            frame_parameters = self.camera_settings.get_current_frame_parameters()
+            frame_parameters["chrono_path"] = value
+            self.camera_settings.set_current_frame_parameters(frame_parameters)
+
+        def set_spim_stream_path(value):
+            frame_parameters = self.camera_settings.get_current_frame_parameters()
+            frame_parameters["spim_stream_path"] = value
+            self.camera_settings.set_current_frame_parameters(frame_parameters)
+
+        def set_cumul_rejection(value):
+            frame_parameters = self.camera_settings.get_current_frame_parameters()
+            frame_parameters["cumul_rejection"] = value
+            self.camera_settings.set_current_frame_parameters(frame_parameters)
+
+        def set_cumul_k(value):
+            frame_parameters = self.camera_settings.get_current_frame_parameters()
+            frame_parameters["cumul_k"] = value
+            self.camera_settings.set_current_frame_parameters(frame_parameters)
+
+        def set_strips(value):
+            frame_parameters = self.camera_settings.get_current_frame_parameters()
+            frame_parameters["strips"] = value
+            self.camera_settings.set_current_frame_parameters(frame_parameters)
+
+        def set_zlp_align(value):
+            frame_parameters = self.camera_settings.get_current_frame_parameters()
+            frame_parameters["zlp_align"] = value
+            self.camera_settings.set_current_frame_parameters(frame_parameters)
+
+        def set_zlp_fourier(value):
+            frame_parameters = self.camera_settings.get_current_frame_parameters()
+            frame_parameters["zlp_fourier"] = value
+            self.camera_settings.set_current_frame_parameters(frame_parameters)
+
+        def set_hdr_exposures(value):
+            frame_parameters = self.camera_settings.get_current_frame_parameters()
+            frame_parameters["hdr_exposures_ms"] = value
+            self.camera_settings.set_current_frame_parameters(frame_parameters)
+
+        def set_storage(value):
+            frame_parameters = self.camera_settings.get_current_frame_parameters()
+            frame_parameters["storage_dtype"] = VGCameraYves.STORAGE_DTYPES[value]
+            self.camera_settings.set_current_frame_parameters(frame_parameters)
+
+        def set_correction(value):
+            frame_parameters = self.camera_settings.get_current_frame_parameters()
+            frame_parameters["correction"] = value
+            self.camera_settings.set_current_frame_parameters(frame_parameters)
+
+        def set_correction_float(value):
+            frame_parameters = self.camera_settings.get_current_frame_parameters()
+            frame_parameters["correction_float"] = value
+            self.camera_settings.set_current_frame_parameters(frame_parameters)
+
         def set_roi(value):
             area = self.__areas[value]
             frame_parameters = self.camera_settings.get_current_frame_parameters()
@@ -286,6 +412,26 @@ class CameraHandler:
             frame_parameters["tp3mode"] = value
             self.camera_settings.set_current_frame_parameters(frame_parameters)
 
+        def set_tp3drift(value):
+            frame_parameters = self.camera_settings.get_current_frame_parameters()
+            frame_parameters["tp3drift"] = value
+            self.camera_settings.set_current_frame_parameters(frame_parameters)
+
+        def set_tp3roi(value):
+            frame_parameters = self.camera_settings.get_current_frame_parameters()
+            frame_parameters["tp3roi"] = (self.tp3roi_start_model.value, self.tp3roi_end_model.value)
+            self.camera_settings.set_current_frame_parameters(frame_parameters)
+
+        def set_tp3bin(value):
+            frame_parameters = self.camera_settings.get_current_frame_parameters()
+            frame_parameters["tp3bin"] = value
+            self.camera_settings.set_current_frame_parameters(frame_parameters)
+
+        def set_tp3process(value):
+            frame_parameters = self.camera_settings.get_current_frame_parameters()
+            frame_parameters["tp3process"] = value
+            self.camera_settings.set_current_frame_parameters(frame_parameters)
+
         self.roi_item.on_value_changed = set_roi
         self.port_item.on_value_changed = set_port
         self.speed_item.on_value_changed = set_speed
@@ -300,14 +446,34 @@ class CameraHandler:
         self.tab_v_binning.on_value_changed = set_v_binning_tab
         self.exposure_model.on_value_changed = set_exposure
         self.nbspectra_model.on_value_changed = set_nbspectra
+        self.chrono_ring_model.on_value_changed = set_chrono_ring
+        self.spim_stream_path_model.on_value_changed = set_spim_stream_path
+        self.cumul_rejection_item.on_value_changed = set_cumul_rejection
+        self.cumul_k_model.on_value_changed = set_cumul_k
+        self.strips_model.on_value_changed = set_strips
+        self.zlp_align_item.on_value_changed = set_zlp_align
+        self.zlp_fourier_model.on_value_changed = set_zlp_fourier
+        self.hdr_exposures_model.on_value_changed = set_hdr_exposures
+        self.storage_item.on_value_changed = set_storage
+        self.correction_item.on_value_changed = set_correction
+        self.correction_float_model.on_value_changed = set_correction_float
+        self.chrono_path_model.on_value_changed = set_chrono_path
         self.soft_binning_model.on_value_changed = set_soft_binning
         self.flip_model.on_value_changed=set_flip
         self.delay_value.on_value_changed=set_tp3_delay
         self.width_value.on_value_changed=set_tp3_width
         self.tp3mode_item.on_value_changed = set_tp3mode
+        self.tp3drift_model.on_value_changed = set_tp3drift
+        self.tp3roi_start_model.on_value_changed = set_tp3roi
+        self.tp3roi_end_model.on_value_changed = set_tp3roi
+        self.tp3bin_model.on_value_changed = set_tp3bin
+        self.tp3process_model.on_value_changed = set_tp3process
 
         self.mode_item.on_value_changed = set_mode
 
+        self.__update_all_setup_widgets = update_all_setup_widgets
+        self.__update_binning = update_binning
+
         update_all_setup_widgets()
         update_binning()
         update_exposure()
@@ -341,8 +507,70 @@ class CameraHandler:
         # print(f"At start exposure = {self.exposure_model.value}")
         self.hardware_source.start_playing()
 
-    def measure_clicked(selfself, widget):
-        pass
+    def measure_clicked(self, widget):
+        """
+        Measures the reference of the selected method: dark for Readout, flat field for Gain. For Both, the dark is
+        measured first if missing, the flat field otherwise.
+        """
+        if self.hardware_source.is_playing:
+            logging.info('***CAMERA***: Please stop camera before measuring correction references.')
+            return
+        method = self.correction_item.value
+        if method == VGCameraYves.FrameCorrection.NONE:
+            return
+        settings = self.camera_settings.get_current_frame_parameters()
+        dark_missing = VGCameraYves.FrameCorrection.dark_key(settings) not in self.camera_device.correction.darks
+        reference = "dark" if method == VGCameraYves.FrameCorrection.READOUT or (
+                method == VGCameraYves.FrameCorrection.BOTH and dark_missing) else "flat"
+        threading.Thread(target=self.camera_device.measure_correction, args=(reference,)).start()
+
+    def hdr_dark_clicked(self, widget):
+        """Measures the dark reference of every exposure of the HDR bracket (beam blanked)."""
+        if self.hardware_source.is_playing:
+            logging.info('***CAMERA***: Please stop camera before measuring the HDR darks.')
+            return
+        threading.Thread(target=self.camera_device.measure_hdr_darks).start()
+
+    def hdr_clicked(self, widget):
+        """
+        Acquires the HDR merge of the exposure bracket in a new data item: one frame, or a stacked chrono of
+        spectra_count frames in the chrono modes.
+        """
+        if self.hardware_source.is_playing:
+            logging.info('***CAMERA***: Please stop camera before an HDR acquisition.')
+            return
+        settings = self.camera_settings.get_current_frame_parameters()
+        count = settings.spectra_count if "Chrono" in settings.acquisition_mode else 1
+
+        def acquire():
+            result = self.camera_device.acquire_hdr(count)
+            if result is None:
+                return
+
+            def show():
+                descriptor = self.__api.create_data_descriptor(False, result["collection_dimension_count"],
+                                                               result["datum_dimension_count"])
+                xdata = self.__api.create_data_and_metadata(result["data"], data_descriptor=descriptor,
+                                                            metadata={"hardware_source": result["properties"]})
+                self.__api.library.create_data_item_from_data_and_metadata(
+                    xdata, title=f"{self.camera_device.camera_name} HDR")
+
+            self.event_loop.call_soon_threadsafe(show)
+
+        threading.Thread(target=acquire).start()
+
+    def plan_clicked(self, widget):
+        plan = self.camera_device.plan_readout(self.target_rate_model.value, self.soft_binning_model.value,
+                                               self.__areas, self.h_binning_values, self.v_binning_values)
+        if plan is None:
+            self.plan_text.value = "No valid readout"
+            return
+        frame_parameters = self.camera_settings.get_current_frame_parameters()
+        frame_parameters.update(plan["frame_parameters"])
+        self.camera_settings.set_current_frame_parameters(frame_parameters)
+        self.__update_all_setup_widgets()
+        self.__update_binning()
+        self.plan_text.value = f"{plan['frame_rate']:.1f} Hz ({plan['readout_time'] * 1000:.2f} ms readout)"
 
     async def update_buttons(self):
         is_playing = self.hardware_source.is_playing
@@ -397,7 +625,44 @@ class CameraPanelFactory:
 
         experiment_row2 = ui.create_row(ui.create_label(text=_("Dwell Time (ms)")), exposure_line_edit, spacing=8)
 
-        experiment_content = ui.create_column(experiment_row1, experiment_row2, spacing=8)
+        chrono_ring = ui.create_check_box(name='chrono_ring_value', text='Ring',
+                                          checked='@binding(chrono_ring_model.value)')
+        chrono_path = ui.create_line_edit(text="@binding(chrono_path_model.value)", placeholder_text=_("Save folder"))
+        storage_combo = ui.create_combo_box(items_ref="storage_items", current_index="@binding(storage_item.value)")
+        experiment_row3 = ui.create_row(chrono_ring, chrono_path, storage_combo, spacing=8)
+
+        spim_stream_path = ui.create_line_edit(text="@binding(spim_stream_path_model.value)",
+                                               placeholder_text=_("Not streamed"))
+        experiment_row4 = ui.create_row(ui.create_label(text=_("Spim folder")), spim_stream_path, spacing=8)
+
+        cumul_rejection_combo = ui.create_combo_box(items_ref="cumul_rejection_items",
+                                                    current_index="@binding(cumul_rejection_item.value)")
+        cumul_k_line_edit = ui.create_line_edit(text="@binding(cumul_k_model.value, converter=cumul_k_converter)")
+        experiment_row5 = ui.create_row(ui.create_label(text=_("Cumul")), cumul_rejection_combo,
+                                        ui.create_label(text=_("k")), cumul_k_line_edit, spacing=8)
+
+        strips_line_edit = ui.create_line_edit(text="@binding(strips_model.value, converter=strips_converter)",
+                                               placeholder_text=_("Full frame"))
+        experiment_row6 = ui.create_row(ui.create_label(text=_("Strips (rows)")), strips_line_edit, spacing=8)
+
+        zlp_align_combo = ui.create_combo_box(items_ref="zlp_align_items",
+                                              current_index="@binding(zlp_align_item.value)")
+        zlp_fourier = ui.create_check_box(name="zlp_fourier_value", text=_("Fourier shift"),
+                                          checked="@binding(zlp_fourier_model.value)")
+        experiment_row7 = ui.create_row(ui.create_label(text=_("1D Chrono")), zlp_align_combo, zlp_fourier, spacing=8)
+
+        hdr_exposures = ui.create_line_edit(
+            text="@binding(hdr_exposures_model.value, converter=hdr_exposures_converter)",
+            placeholder_text=_("Dwell / 100, / 10, x 1"))
+        hdr_dark_button = ui.create_push_button(name="hdr_dark_button", text=_("HDR dark"),
+                                                on_clicked="hdr_dark_clicked")
+        hdr_button = ui.create_push_button(name="hdr_button", text=_("HDR"), on_clicked="hdr_clicked")
+        experiment_row8 = ui.create_row(ui.create_label(text=_("Exposures (ms)")), hdr_exposures, hdr_dark_button,
+                                        hdr_button, spacing=8)
+
+        experiment_content = ui.create_column(experiment_row1, experiment_row2, experiment_row3, experiment_row4,
+                                              experiment_row5, experiment_row6, experiment_row7, experiment_row8,
+                                              spacing=8)
 
         experiment_group = ui.create_group(experiment_content, title=_("Experiment"))
 
@@ -425,7 +690,21 @@ class CameraPanelFactory:
         tp3mode = ui.create_row(ui.create_label(text=_("Tp3 Mode: ")),
                               ui.create_combo_box(items=["Spectrum", "Spectrum TR", "Spim", "Spim TR", "Spim PM"],  current_index="@binding(tp3mode_item.value)"), ui.create_stretch())
 
-        tp3_column = ui.create_column(current_column, delay_row, width_row, tp3mode, spacing=2)
+        tp3drift = ui.create_check_box(name='tp3drift_value', text='Drift correction (Spim)',
+                                       checked='@binding(tp3drift_model.value)')
+
+        tp3roi_row = ui.create_row(ui.create_label(text='Energy ROI: '),
+                                   ui.create_line_edit(name='tp3roi_start_value', text="@binding(tp3roi_start_model.value, converter=tp3_converter)"),
+                                   ui.create_line_edit(name='tp3roi_end_value', text="@binding(tp3roi_end_model.value, converter=tp3_converter)"),
+                                   ui.create_label(text='Bin: '),
+                                   ui.create_line_edit(name='tp3bin_value', text="@binding(tp3bin_model.value, converter=tp3_converter)"),
+                                   ui.create_stretch(), spacing=2)
+
+        tp3process = ui.create_check_box(name='tp3process_value', text='Separate ingestion process',
+                                         checked='@binding(tp3process_model.value)')
+
+        tp3_column = ui.create_column(current_column, delay_row, width_row, tp3mode, tp3drift, tp3roi_row, tp3process,
+                                      spacing=2)
         tp3_group = ui.create_group(tp3_column, title=_("TimePix3"))
 
         """
@@ -496,21 +775,32 @@ class CameraPanelFactory:
         threshold_line_edit = ui.create_line_edit(text="@binding(threshold_model.value, converter=threshold_converter)")
         threshold_row = ui.create_row(ui.create_label(text=_("Video threshold")), ui.create_stretch(),
                                       threshold_line_edit, spacing=8)
-        threshold_column = ui.create_column(correction_row, threshold_row, spacing=8, margin=4)
+        correction_float = ui.create_check_box(name="correction_float_value", text=_("Float32 output"),
+                                               checked="@binding(correction_float_model.value)")
+        threshold_column = ui.create_column(correction_row, correction_float, threshold_row, spacing=8, margin=4)
 
         correction_group = ui.create_group(threshold_column, title=_("Corrections"))
 
+        target_rate_line_edit = ui.create_line_edit(
+            text="@binding(target_rate_model.value, converter=target_rate_converter)")
+        plan_button = ui.create_push_button(name="plan_button", text=_("Plan"), on_clicked="plan_clicked")
+        plan_row = ui.create_row(ui.create_label(text=_("Target (Hz)")), target_rate_line_edit, plan_button, spacing=8)
+        plan_column = ui.create_column(plan_row, ui.create_label(text="@binding(plan_text.value)"), spacing=8,
+                                       margin=4)
+
+        plan_group = ui.create_group(plan_column, title=_("Readout planner"))
+
         fan_checkbox = ui.create_check_box(name="fan_check_box", text="Fan Enabled",
                                            checked="@binding(fan_enabled_model.value)")
 
         # shutter_checkbox = ui.create_check_box(name="shutter_check_box", text="Shutter Enabled", checked="@binding(shutter_enabled_model.value)")
 
         if len(ports) > 1:
-            setup_column = ui.create_column(roi_row, port_row, speed_row, flip_value, gain_group, correction_group, fan_checkbox,
-                                            ui.create_stretch(), spacing=8, margin=4)
+            setup_column = ui.create_column(roi_row, port_row, speed_row, flip_value, gain_group, correction_group,
+                                            plan_group, fan_checkbox, ui.create_stretch(), spacing=8, margin=4)
         else:
-            setup_column = ui.create_column(roi_row, speed_row, gain_group, correction_group, fan_checkbox,
-                                            ui.create_stretch(), spacing=8, margin=4)
+            setup_column = ui.create_column(roi_row, speed_row, gain_group, correction_group, plan_group,
+                                            fan_checkbox, ui.create_stretch(), spacing=8, margin=4)
 
 
     ############################### SPIM BEGIN #######################
@@ -1,4 +1,6 @@
 # standard libraries
+import bisect
+import collections
 import copy
 import ctypes
 import gettext
@@ -36,6 +38,604 @@ class Orsay_Data(Enum):
     real = 12
 
 
+FRAME_BUFFERS = 4
+STORAGE_DTYPES = ("float32", "uint16", "uint32")
+
+
+def storage_dtype(name, summed_rows=1):
+    """
+    numpy type of the chrono and spim buffers, handed as is to the DLL by the spim data locker. Spectra summed from
+    summed_rows 16 bit rows (soft binning, spim spectra) are promoted so the camera sums cannot wrap around: uint16
+    to uint32, and uint32 to float32 if even that could overflow.
+    """
+    dtype = numpy.dtype(name)
+    if dtype == numpy.uint16 and summed_rows > 1:
+        dtype = numpy.dtype(numpy.uint32)
+    if dtype == numpy.uint32 and summed_rows * 0xFFFF > 0xFFFFFFFF:
+        dtype = numpy.dtype(numpy.float32)
+    return dtype
+
+
+class FrameBufferPool:
+    """
+    Preallocated frame buffers rotated between the data locker and unlocker callbacks.
+
+    A buffer is free, locked (the camera writes in it), ready (complete, waiting for acquire_image) or held (handed
+    out to Swift). The held buffer goes back to the free list at the next acquire, so the camera never writes in a
+    frame Swift is still using. When every buffer is busy, the oldest ready frame is reused and counted as dropped.
+    """
+
+    def __init__(self, count, shape, dtype=numpy.float32):
+        self.buffers = [numpy.zeros(shape, dtype=dtype) for _ in range(count)]
+        self.pointers = [buffer.ctypes.data_as(ctypes.c_void_p) for buffer in self.buffers]
+        self.dropped = 0
+        self.__free = collections.deque(range(count))
+        self.__ready = collections.deque()
+        self.__locked = None
+        self.__held = None
+        self.__lock = threading.Lock()
+
+    def lock(self):
+        with self.__lock:
+            if self.__locked is None:
+                if self.__free:
+                    self.__locked = self.__free.popleft()
+                elif self.__ready:
+                    self.__locked = self.__ready.popleft()
+                    self.dropped += 1
+                else:  # single buffer pool, the camera shares it with Swift
+                    self.__locked = self.__held
+            return self.pointers[self.__locked].value
+
+    def unlock(self, new_data):
+        with self.__lock:
+            index, self.__locked = self.__locked, None
+            if index is None:
+                return
+            if new_data:
+                self.__ready.append(index)
+            elif index != self.__held:
+                self.__free.append(index)
+
+    @property
+    def ready(self):
+        with self.__lock:
+            return len(self.__ready)
+
+    def acquire(self):
+        """
+        Returns the oldest completed buffer, or None if no new frame arrived since the last call (the one already
+        held is still Swift's), and the number of frames still waiting.
+        """
+        with self.__lock:
+            if not self.__ready:
+                return None, 0
+            previous, self.__held = self.__held, self.__ready.popleft()
+            if previous is not None and previous != self.__held and previous != self.__locked \
+                    and previous not in self.__ready:
+                self.__free.append(previous)
+            return self.buffers[self.__held], len(self.__ready)
+
+
+class ChronoRing:
+    """
+    Ring buffer of the last depth chrono frames.
+
+    Each frame is written twice, at its slot and depth slots later, so the last depth frames are always contiguous
+    and view() returns them oldest first without copying. With a directory (created if needed), a thread copies the
+    frames to disk as they arrive, every lap of depth frames in its own chrono_NNNNN.npy, so the camera callback
+    never waits for the disk. A frame has a whole lap to be written before its slot is reused, frames the thread
+    could not keep up with stay zeros in their file. close() writes what is left, the last lap cut to its frames.
+    """
+
+    def __init__(self, depth, frame_shape, dtype=numpy.float32, directory=None):
+        self.depth = depth
+        self.buffer = numpy.zeros((2 * depth, *frame_shape), dtype=dtype)
+        self.count = 0
+        self.segment = 0
+        self.directory = directory
+        self.lost = 0
+        self.__written = 0
+        self.__file = None
+        self.__stop = False
+        self.__event = threading.Event()
+        self.__thread = None
+        if directory:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except OSError as e:
+                logging.info(f"***CAMERA***: Could not create the chrono folder {directory}: {e}")
+                return
+            self.__thread = threading.Thread(target=self.__run, daemon=True)
+            self.__thread.start()
+
+    def append(self, frame):
+        slot = self.count % self.depth
+        self.buffer[slot] = frame
+        self.buffer[slot + self.depth] = frame
+        self.count += 1
+        if self.__thread is not None:
+            self.__event.set()
+
+    def view(self):
+        if self.count < self.depth:
+            return self.buffer[:self.depth]
+        start = self.count % self.depth
+        return self.buffer[start:start + self.depth]
+
+    def close(self):
+        """Writes the frames still waiting and stops the writer thread."""
+        thread, self.__thread = self.__thread, None
+        if thread is not None:
+            self.__stop = True
+            self.__event.set()
+            thread.join()
+            if self.lost:
+                logging.info(f"***CAMERA***: {self.lost} chrono frames were overwritten before reaching the disk.")
+
+    def __path(self, segment):
+        return os.path.join(self.directory, f"chrono_{segment:05d}.npy")
+
+    def __run(self):
+        while True:
+            self.__event.wait()
+            self.__event.clear()
+            final = self.__stop
+            try:
+                self.__write()
+                if final:
+                    self.__finish()
+            except OSError as e:
+                logging.info(f"***CAMERA***: Could not save chrono segment {self.__path(self.segment)}: {e}")
+                return
+            if final:
+                return
+
+    def __write(self):
+        while self.__written < self.count:
+            index = self.__written
+            if self.count - index > self.depth:  # slot already reused
+                self.lost += self.count - self.depth - index
+                index = self.__written = self.count - self.depth
+            segment, position = divmod(index, self.depth)
+            if self.__file is None or segment != self.segment:
+                self.__file = numpy.lib.format.open_memmap(self.__path(segment), mode="w+", dtype=self.buffer.dtype,
+                                                           shape=(self.depth, *self.buffer.shape[1:]))
+                self.segment = segment
+            self.__file[position] = self.buffer[index % self.depth]
+            if self.count - index > self.depth:  # overwritten while being copied
+                self.__file[position] = 0
+                self.lost += 1
+            self.__written = index + 1
+            if position == self.depth - 1:
+                self.__file.flush()
+                self.__file = None
+
+    def __finish(self):
+        if self.__file is not None:
+            frames = self.__written - self.segment * self.depth
+            self.__file.flush()
+            data = numpy.array(self.__file[:frames])
+            self.__file = None
+            numpy.save(self.__path(self.segment), data)
+
+ZLP_NONE, ZLP_CENTROID, ZLP_PARABOLA = 0, 1, 2
+
+
+def align_zlp(stack, fit=ZLP_CENTROID, fourier=False, window=5):
+    """
+    Aligns the zero loss peak of a stack of spectra (frames, channels) and sums them.
+
+    Every ZLP is found at once, to a fraction of a channel, by a centroid over +-window channels around the maximum or
+    by a parabola through the maximum and its two neighbours. Spectra are then shifted onto the median position, by
+    linear interpolation (no wrap around) or in Fourier space (zero padded). Empty spectra (chrono not yet filled)
+    are left out. Returns the aligned sum and the drift of each spectrum in channels (nan when left out). Works on a
+    finished stack as well as on ChronoRing.view().
+    """
+    stack = numpy.asarray(stack, dtype=numpy.float32)
+    frames, channels = stack.shape
+    rows = numpy.arange(frames)
+    peak = numpy.argmax(stack, axis=1)
+    valid = stack[rows, peak] > 0
+    if fit == ZLP_PARABOLA:
+        left = stack[rows, numpy.clip(peak - 1, 0, channels - 1)]
+        centre = stack[rows, peak]
+        right = stack[rows, numpy.clip(peak + 1, 0, channels - 1)]
+        curvature = left - 2 * centre + right
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            offset = numpy.where(curvature < 0, 0.5 * (left - right) / curvature, 0.)
+        position = peak + numpy.clip(offset, -0.5, 0.5)
+    else:
+        index = numpy.clip(peak[:, None] + numpy.arange(-window, window + 1), 0, channels - 1)
+        values = numpy.take_along_axis(stack, index, axis=1)
+        values = values - values.min(axis=1, keepdims=True)
+        total = values.sum(axis=1)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            position = numpy.where(total > 0, (values * index).sum(axis=1) / total, peak)
+    drift = numpy.full(frames, numpy.nan)
+    if not valid.any():
+        return numpy.zeros(channels, dtype=numpy.float32), drift
+    drift[valid] = position[valid] - numpy.median(position[valid])
+    stack, shift = stack[valid], drift[valid]
+    if fourier:
+        size = 2 * channels
+        frequency = numpy.fft.rfftfreq(size)
+        spectra = numpy.fft.rfft(stack, n=size, axis=1) * numpy.exp(2j * numpy.pi * frequency * shift[:, None])
+        aligned = numpy.fft.irfft(spectra, n=size, axis=1)[:, :channels]
+    else:
+        source = numpy.arange(channels) + shift[:, None]
+        lower = numpy.floor(source).astype(numpy.intp)
+        fraction = source - lower
+        inside = (lower >= 0) & (lower < channels - 1)
+        lower = numpy.clip(lower, 0, channels - 2)
+        aligned = numpy.take_along_axis(stack, lower, axis=1) * (1 - fraction) + \
+                  numpy.take_along_axis(stack, lower + 1, axis=1) * fraction
+        aligned[~inside] = 0
+    return aligned.sum(axis=0).astype(numpy.float32), drift
+
+
+def merge_hdr(frames, exposures, saturation, darks=None):
+    """
+    Merges frames of the same scene taken with different exposures into one high dynamic range frame.
+
+    frames is (exposures, ...), raw per pixel values (no soft binning) so that saturation means something, and darks
+    the matching dark frame of each exposure, subtracted after the saturation test. Every pixel is the exposure
+    weighted average of its count rates over the frames where it is below saturation (the Poisson estimate: counts
+    summed over exposures summed), scaled to the longest exposure. A pixel saturated everywhere keeps the rate of the
+    shortest exposure, a lower bound. Returns the merged frame and the number of such pixels.
+    """
+    stack = numpy.asarray(frames, dtype=numpy.float32)
+    exposures = numpy.asarray(exposures, dtype=numpy.float32)
+    times = exposures.reshape((-1,) + (1,) * (stack.ndim - 1))
+    valid = stack < saturation
+    if darks is not None:
+        for frame, dark in zip(stack, darks):
+            frame -= dark
+    weights = numpy.where(valid, times, 0).sum(axis=0)
+    counts = numpy.where(valid, stack, 0).sum(axis=0)
+    saturated = weights == 0
+    shortest = numpy.argmin(exposures)
+    rate = numpy.divide(counts, weights, out=stack[shortest] / exposures[shortest], where=~saturated)
+    return rate * exposures.max(), int(saturated.sum())
+
+
+class SpimStreamWriter:
+    """
+    Writes the completed lines of a camera spim to disk while it is being acquired.
+
+    The unlock callback only reports how many lines are complete, a thread copies them from the cube into .npy chunks
+    of chunk_lines lines. index.json is rewritten (atomically) after every chunk with the cube shape, dtype, the chunk
+    list and the number of valid lines, so an interrupted spim can be read back with load_spim_stream.
+    """
+
+    def __init__(self, directory, cube, chunk_lines=8):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.cube = cube
+        self.chunk_lines = max(int(chunk_lines), 1)
+        self.lines_written = 0
+        self.__lines_done = 0
+        self.__chunks = list()
+        self.__stop = False
+        self.__event = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__write_index()
+        self.__thread.start()
+
+    def lines_done(self, lines):
+        lines = min(int(lines), self.cube.shape[0])
+        if lines > self.__lines_done:
+            self.__lines_done = lines
+            self.__event.set()
+
+    def close(self):
+        """Writes the remaining complete lines, even if they do not fill a chunk, and stops the thread."""
+        self.__stop = True
+        self.__event.set()
+        self.__thread.join()
+        logging.info(f"***CAMERA***: {self.lines_written} spim lines saved in {self.directory}")
+
+    def __run(self):
+        while True:
+            self.__event.wait()
+            self.__event.clear()
+            final = self.__stop
+            try:
+                self.__write(final)
+            except OSError as e:
+                logging.info(f"***CAMERA***: Spim streaming to {self.directory} failed: {e}")
+                return
+            if final:
+                return
+
+    def __write(self, final):
+        while self.__lines_done - self.lines_written >= self.chunk_lines or \
+                (final and self.__lines_done > self.lines_written):
+            end = min(self.lines_written + self.chunk_lines, self.__lines_done)
+            name = f"chunk_{len(self.__chunks):05d}.npy"
+            numpy.save(os.path.join(self.directory, name), self.cube[self.lines_written:end])
+            self.__chunks.append(name)
+            self.lines_written = end
+            self.__write_index()
+
+    def __write_index(self):
+        index = {"shape": list(self.cube.shape), "dtype": str(self.cube.dtype), "lines": self.lines_written,
+                 "chunks": self.__chunks}
+        path = os.path.join(self.directory, "index.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(path + ".tmp", path)
+
+
+def load_spim_stream(directory):
+    """
+    Reads back a spim written by SpimStreamWriter. Lines that never reached the disk are zeros.
+    """
+    with open(os.path.join(directory, "index.json")) as f:
+        index = json.load(f)
+    cube = numpy.zeros(index["shape"], dtype=index["dtype"])
+    line = 0
+    for name in index["chunks"]:
+        chunk = numpy.load(os.path.join(directory, name))
+        cube[line:line + chunk.shape[0]] = chunk
+        line += chunk.shape[0]
+    return cube
+
+
+class StripExtractor:
+    """
+    Sums several row bands (strips) of a 2D frame into one spectrum each, in a single pass.
+
+    Strip limits are cut into contiguous segments, numpy.add.reduceat sums the rows of every segment at once and a
+    0/1 segment map adds the segments back into strips, so strips may overlap. strips are (first row, last row + 1).
+    The rows after the last strip form a trailing segment of zero weight, reduceat running its last one to the end.
+    """
+
+    def __init__(self, strips, rows):
+        self.rows = rows
+        self.requested = [tuple(strip) for strip in strips]
+        self.strips = [(max(int(start), 0), min(int(end), rows)) for start, end in strips]
+        self.strips = [(start, end) for start, end in self.strips if end > start]
+        bounds = sorted({bound for strip in self.strips for bound in strip})
+        if bounds and bounds[-1] >= rows:
+            bounds = bounds[:-1]
+        self.indices = numpy.array(bounds, dtype=numpy.intp)
+        self.segments = numpy.zeros((len(self.strips), len(self.indices)), dtype=numpy.float32)
+        for strip, (start, end) in enumerate(self.strips):
+            self.segments[strip] = (self.indices >= start) & (self.indices < end)
+
+    def extract(self, frame):
+        if not self.strips:
+            return frame
+        return self.segments @ numpy.add.reduceat(frame, self.indices, axis=0, dtype=numpy.float32)
+
+
+class CumulAccumulator:
+    """
+    Host side Cumul with outlier (cosmic ray, hot event) rejection, memory bounded by k frames.
+
+    SIGMA keeps per pixel running mean and variance (Welford). After k frames, a pixel above mean + sigma * std is
+    replaced by the mean before being summed. The variance is floored at the mean, the shot noise, so that flat pixels
+    do not reject everything. MEDIAN stacks k frames and sums k times their per pixel median, the last incomplete
+    stack is summed as it is until it fills up.
+    """
+
+    NONE, SIGMA, MEDIAN = range(3)
+
+    def __init__(self, shape, method, k=5, sigma=5.):
+        self.method = method
+        self.k = max(int(k), 2)
+        self.sigma = sigma
+        self.count = 0
+        self.rejected = 0
+        self.total = numpy.zeros(shape, dtype=numpy.float32)
+        self.result = numpy.zeros(shape, dtype=numpy.float32)
+        if method == self.MEDIAN:
+            self.stack = numpy.zeros((self.k,) + tuple(shape), dtype=numpy.float32)
+            self.index = 0
+        else:
+            self.mean = numpy.zeros(shape, dtype=numpy.float32)
+            self.m2 = numpy.zeros(shape, dtype=numpy.float32)
+
+    def add(self, frame):
+        if self.method == self.MEDIAN:
+            self.stack[self.index] = frame
+            self.index += 1
+            if self.index == self.k:
+                self.total += numpy.median(self.stack, axis=0) * self.k
+                self.index = 0
+        else:
+            if self.count >= self.k:
+                limit = self.mean + self.sigma * numpy.sqrt(numpy.maximum(self.m2 / self.count, self.mean))
+                outliers = frame > limit
+                self.rejected += int(numpy.count_nonzero(outliers))
+                frame = numpy.where(outliers, self.mean, frame)
+            delta = frame - self.mean
+            self.mean += delta / (self.count + 1)
+            self.m2 += delta * (frame - self.mean)
+            self.total += frame
+        self.count += 1
+
+    def sum(self):
+        if self.method == self.MEDIAN and self.index:
+            numpy.add(self.total, self.stack[:self.index].sum(axis=0), out=self.result)
+        else:
+            self.result[...] = self.total
+        return self.result
+
+
+class FrameCorrection:
+    """
+    Dark (readout) subtraction and gain normalisation of camera frames.
+
+    Dark references are keyed by exposure, binning, area and soft binning, gain references by the same minus exposure.
+    The gain reference is kept as the inverse normalised flat field, so the correction is one subtraction and one
+    multiplication, done in place when the frame is float, in a float32 copy otherwise (or when asked to).
+    """
+
+    NONE, READOUT, GAIN, BOTH = range(4)
+
+    def __init__(self):
+        self.darks = dict()
+        self.gains = dict()
+
+    @staticmethod
+    def gain_key(settings):
+        return settings.h_binning, settings.v_binning, tuple(settings.area), settings.soft_binning
+
+    @staticmethod
+    def dark_key(settings):
+        return (settings.exposure_ms,) + FrameCorrection.gain_key(settings)
+
+    def set_dark(self, settings, dark):
+        self.darks[self.dark_key(settings)] = numpy.asarray(dark, dtype=numpy.float32)
+
+    def set_flat(self, settings, flat):
+        flat = numpy.asarray(flat, dtype=numpy.float32)
+        dark = self.darks.get(self.dark_key(settings))
+        if dark is not None and dark.shape == flat.shape:
+            flat = flat - dark
+        else:
+            logging.info("***CAMERA***: No dark reference for the flat field, gain is computed without it.")
+        gain = numpy.zeros_like(flat)
+        numpy.divide(flat.mean(), flat, out=gain, where=flat > 0)
+        self.gains[self.gain_key(settings)] = gain
+
+    def apply(self, frame, settings, mode, accumulation=1, to_float=False):
+        """
+        Returns the corrected frame. accumulation is the number of summed frames in the buffer (Cumul).
+        """
+        dark = self.darks.get(self.dark_key(settings)) if mode in (self.READOUT, self.BOTH) else None
+        gain = self.gains.get(self.gain_key(settings)) if mode in (self.GAIN, self.BOTH) else None
+        if dark is not None and dark.shape != frame.shape:
+            dark = None
+        if gain is not None and gain.shape != frame.shape:
+            gain = None
+        if dark is None and gain is None:
+            return frame
+        if to_float or frame.dtype.kind != 'f':
+            frame = frame.astype(numpy.float32)
+        if dark is not None:
+            if accumulation != 1:
+                frame -= dark * accumulation
+            else:
+                frame -= dark
+        if gain is not None:
+            frame *= gain
+        return frame
+
+
+class AcquisitionMetrics:
+    """
+    Unlock to acquire_image latency of the delivered frames.
+
+    The unlock callbacks call unlocked() for each new frame, acquire_image calls delivered() with the number of frames
+    still queued behind the one it returns. Older frames that were never returned are counted as missed, unless the
+    mode accumulates them in its buffer (chrono, spim). Latencies go in a histogram with LATENCY_BINS_MS edges.
+    """
+
+    LATENCY_BINS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+    def __init__(self, depth=1024):
+        self.__stamps = collections.deque(maxlen=depth)
+        self.__lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.__lock:
+            self.__stamps.clear()
+            self.histogram = [0] * (len(self.LATENCY_BINS_MS) + 1)
+            self.unlocked_frames = 0
+            self.delivered_frames = 0
+            self.missed_frames = 0
+            self.last_latency_ms = None
+            self.max_latency_ms = 0.
+            self.__latency_sum = 0.
+            self.__start = time.perf_counter()
+
+    def unlocked(self):
+        with self.__lock:
+            if len(self.__stamps) == self.__stamps.maxlen:
+                self.missed_frames += 1
+            self.__stamps.append(time.perf_counter())
+            self.unlocked_frames += 1
+
+    def delivered(self, queued=0, accumulating=False):
+        with self.__lock:
+            if len(self.__stamps) <= queued:  # nothing new, same frame returned again
+                return None
+            older = len(self.__stamps) - queued - 1
+            if not accumulating:
+                self.missed_frames += older
+            for _ in range(older):
+                self.__stamps.popleft()
+            latency = (time.perf_counter() - self.__stamps.popleft()) * 1000
+            self.histogram[bisect.bisect_left(self.LATENCY_BINS_MS, latency)] += 1
+            self.delivered_frames += 1
+            self.last_latency_ms = latency
+            self.max_latency_ms = max(self.max_latency_ms, latency)
+            self.__latency_sum += latency
+            return latency
+
+    def as_dict(self):
+        with self.__lock:
+            elapsed = time.perf_counter() - self.__start
+            return {
+                "unlocked_frames": self.unlocked_frames,
+                "delivered_frames": self.delivered_frames,
+                "missed_frames": self.missed_frames,
+                "last_latency_ms": self.last_latency_ms,
+                "mean_latency_ms": self.__latency_sum / self.delivered_frames if self.delivered_frames else None,
+                "max_latency_ms": self.max_latency_ms,
+                "latency_bins_ms": self.LATENCY_BINS_MS,
+                "latency_histogram": list(self.histogram),
+                "unlock_rate_hz": self.unlocked_frames / elapsed if elapsed > 0 else 0.,
+                "delivery_rate_hz": self.delivered_frames / elapsed if elapsed > 0 else 0.,
+            }
+
+
+class CCDStatusMonitor:
+    """
+    Reads the camera status (getCCDStatus) every period seconds in its own thread while acquiring, so the data
+    callbacks use the cached dict instead of a DLL call per frame. With watch_idle, on_idle is called once when the
+    camera falls back to idle after having been seen acquiring.
+    """
+
+    def __init__(self, camera, on_idle, period=0.2):
+        self.camera = camera
+        self.on_idle = on_idle
+        self.period = period
+        self.status = dict()
+        self.__watch_idle = True
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def start(self, watch_idle=True):
+        self.stop()
+        self.status = self.camera.getCCDStatus()
+        self.__watch_idle = watch_idle
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        thread, self.__thread = self.__thread, None
+        if thread is not None:
+            self.__stop.set()
+            if thread is not threading.current_thread():
+                thread.join()
+
+    def __run(self):
+        acquiring = self.status.get("mode", "idle") != "idle"
+        while not self.__stop.wait(self.period):
+            self.status = self.camera.getCCDStatus()
+            if self.status.get("mode") != "idle":
+                acquiring = True
+            elif acquiring and self.__watch_idle:
+                self.on_idle()
+                return
+
+
 class CameraDevice(camera_base.CameraDevice):
 
     def __init__(self, manufacturer, model, sn, simul, instrument: ivg_inst.ivgInstrument, id, name, type):
@@ -48,8 +648,15 @@ class CameraDevice(camera_base.CameraDevice):
             self.camera_callback = tp3func.SENDMYMESSAGEFUNC(self.sendMessageFactory())
             self.camera = tp3func.TimePix3(sn, simul, self.sendMessageFactory())
         else:
-            from nionswift_plugin.IVG.camera import orsaycamera
-            self.camera = orsaycamera.orsayCamera(manufacturer, model, sn, simul)
+            try:
+                from nionswift_plugin.IVG.camera import orsaycamera
+                self.camera = orsaycamera.orsayCameraMirror(orsaycamera.orsayCamera(manufacturer, model, sn, simul))
+            except (ImportError, OSError) as e:  # no Cameras.dll, not the microscope computer
+                if not simul:
+                    raise
+                logging.info(f"***CAMERA***: Cameras library not available ({e}). Python simulation of {model}.")
+                from nionswift_plugin.IVG.camera import orsaycamera_sim as orsaycamera
+                self.camera = orsaycamera.orsayCamera(manufacturer, model, sn, simul)
         self.__config_dialog_handler = None
         self.__sensor_dimensions = self.camera.getCCDSize()
         self.__readout_area = 0, 0, *self.__sensor_dimensions
@@ -62,6 +669,8 @@ class CameraDevice(camera_base.CameraDevice):
         self.frame_parameter_changed_event = Event.Event()
         self.stop_acquitisition_event = Event.Event()
         self.current_event = Event.Event()
+        self.sequence_progress_event = Event.Event()
+        self.__sequence_cancel = threading.Event()
 
         # register data locker for focus acquisition
         if manufacturer != 4:
@@ -71,8 +680,16 @@ class CameraDevice(camera_base.CameraDevice):
             self.camera.registerDataUnlocker(self.fnunlock)
         self.imagedata = None
         self.imagedata_ptr = None
+        self.frame_pool = None
         self.acquire_data = None
+        self.__delivered = None
         self.has_data_event = threading.Event()
+        self.metrics = AcquisitionMetrics()
+        self.correction = FrameCorrection()
+        self.cumul = None
+        self.strip_extractor = None
+        self.zlp_drift = None
+        self.ccd_status = CCDStatusMonitor(self.camera, self.__camera_idle) if manufacturer != 4 else None
 
     # register data locker for SPIM acquisition
         if manufacturer !=4:
@@ -80,12 +697,17 @@ class CameraDevice(camera_base.CameraDevice):
             self.camera.registerSpimDataLocker(self.fnspimlock)
             self.fnspimunlock = orsaycamera.SPIMUNLOCKFUNC(self.__spim_data_unlocker)
             self.camera.registerSpimDataUnlocker(self.fnspimunlock)
+            self.fnspimupdate = orsaycamera.SPIMUPDATEFUNC(self.__spim_update_info)
+            self.camera.registerSpimUpdateInfo(self.fnspimupdate)
             self.fnspectrumlock = orsaycamera.SPECTLOCKFUNC(self.__spectrum_data_locker)
             self.camera.registerSpectrumDataLocker(self.fnspectrumlock)
             self.fnspectrumunlock = orsaycamera.SPECTUNLOCKFUNC(self.__spectrum_data_unlocker)
             self.camera.registerSpectrumDataUnlocker(self.fnspectrumunlock)
         self.spimimagedata = None
         self.spimimagedata_ptr = None
+        self.chrono_ring = None
+        self.spim_writer = None
+        self.spim_spectrum = 0  # spectra done in the current spim, as reported by the camera
         self.has_spim_data_event = threading.Event()
 
         bx, by = self.camera.getBinning()
@@ -111,6 +733,24 @@ class CameraDevice(camera_base.CameraDevice):
             "timeDelay": 0,
             "timeWidth": 0,
             "tp3mode": 1,
+            "tp3drift": False,
+            "tp3roi": (0, 1025),
+            "tp3bin": 1,
+            "tp3process": False,
+            "chrono_ring": False,
+            "chrono_path": "",
+            "correction": FrameCorrection.NONE,
+            "correction_float": False,
+            "spim_stream_path": "",
+            "cumul_rejection": CumulAccumulator.NONE,
+            "cumul_k": 5,
+            "cumul_sigma": 5.,
+            "strips": [],
+            "zlp_align": ZLP_NONE,
+            "zlp_fourier": False,
+            "hdr_exposures_ms": [],
+            "hdr_saturation": 65000,
+            "storage_dtype": "float32",
         }
 
         self.current_camera_settings = CameraFrameParameters(d)
@@ -125,6 +765,7 @@ class CameraDevice(camera_base.CameraDevice):
         self.__acqspimon = False
         self.__x_pix_spim = 30
         self.__y_pix_spim = 30
+        self.__spim_slave = False
 
         self.isKURO = model.find("KURO") >= 0
         self.isProEM = model.find("ProEM") >= 0
@@ -219,6 +860,22 @@ class CameraDevice(camera_base.CameraDevice):
             self.__hardware_settings.tp3mode = frame_parameters.tp3mode
             self.camera.setTp3Mode(frame_parameters.tp3mode)
 
+        if self.isTimepix and "tp3drift" in frame_parameters:
+            self.__hardware_settings.tp3drift = frame_parameters.tp3drift
+            self.camera.setDriftCorrection(frame_parameters.tp3drift)
+
+        if self.isTimepix and "tp3roi" in frame_parameters:
+            self.__hardware_settings.tp3roi = frame_parameters.tp3roi
+            self.camera.setEnergyRoi(*frame_parameters.tp3roi)
+
+        if self.isTimepix and "tp3bin" in frame_parameters:
+            self.__hardware_settings.tp3bin = frame_parameters.tp3bin
+            self.camera.setEnergyBinning(frame_parameters.tp3bin)
+
+        if self.isTimepix and "tp3process" in frame_parameters:
+            self.__hardware_settings.tp3process = frame_parameters.tp3process
+            self.camera.setIngestProcess(frame_parameters.tp3process)
+
     def __numpy_to_orsay_type(self, array: numpy.array):
         orsay_type = Orsay_Data.float
         if array.dtype == numpy.double:
@@ -244,19 +901,26 @@ class CameraDevice(camera_base.CameraDevice):
         sy[0] = self.sizey
         sz[0] = 1
         data_type[0] = self.__numpy_to_orsay_type(self.imagedata)
+        if self.frame_pool is not None:
+            return self.frame_pool.lock()
         return self.imagedata_ptr.value
 
     def __data_unlocker(self, gene, new_data):
         self.frame_number += 1
-        status = self.camera.getCCDStatus()
+        if self.frame_pool is not None:
+            self.frame_pool.unlock(new_data)
         if new_data:
+            self.metrics.unlocked()
             self.has_data_event.set()
-        if status["mode"] == "Cumul":
-            self.frame_number = status["accumulation_count"]
-        if status["mode"] == "idle":
-            hardware_source = HardwareSource.HardwareSourceManager().get_hardware_source_for_hardware_source_id(
-                self.camera_id)
-            hardware_source.stop_playing()
+        status = self.ccd_status.status
+        if status.get("mode") == "cumul":  # the camera count, if it is ahead of ours
+            self.frame_number = max(self.frame_number, int(status["accumulation_count"]))
+
+    def __camera_idle(self):
+        """The camera stopped by itself (status monitor)."""
+        hardware_source = HardwareSource.HardwareSourceManager().get_hardware_source_for_hardware_source_id(
+            self.camera_id)
+        hardware_source.stop_playing()
 
     def __spim_data_locker(self, gene, data_type, sx, sy, sz):
         sx[0] = self.sizex
@@ -266,8 +930,12 @@ class CameraDevice(camera_base.CameraDevice):
         return self.spimimagedata_ptr.value
 
     def __spim_data_unlocker(self, gene: int, new_data: bool, running: bool):
-        status = self.camera.getCCDStatus()
-        if new_data:
+        if self.spim_writer is not None:
+            self.spim_writer.lines_done(self.spim_spectrum // self.sizey if running else self.sizez)
+        if new_data and self.chrono_ring is not None:
+            self.chrono_ring.append(self.spimimagedata[0])
+        if new_data:  # spim and chrono frames both arrive here
+            self.metrics.unlocked()
             self.has_spim_data_event.set()
         if not running:
             self.has_spim_data_event.set()
@@ -275,6 +943,9 @@ class CameraDevice(camera_base.CameraDevice):
                 self.camera_id)
             hardware_source.stop_playing()
 
+    def __spim_update_info(self, current_spectrum, running):
+        self.spim_spectrum = current_spectrum
+
     def __spectrum_data_locker(self, gene, data_type, sx) -> None:
         if self.__acqon and self.__acqspimon and (self.current_camera_settings.exposure_ms >= 10):
             sx[0] = self.sizex
@@ -313,7 +984,11 @@ class CameraDevice(camera_base.CameraDevice):
         self.__data_item_display = api.library.get_data_item_for_reference_key(self.camera_id)
 
         self.frame_number = 0
+        self.spim_spectrum = 0
+        self.metrics.reset()
+        self.__delivered = None  # last corrected Focus / Cumul frame, returned again when none is new
         self.sizex, self.sizey = self.camera.getImageSize()
+        image_rows = self.sizey
         if self.current_camera_settings.soft_binning:
             self.sizey = 1
         logging.info(f"***CAMERA***: Start live, Image size: {self.sizex} x {self.sizey}"
@@ -324,29 +999,44 @@ class CameraDevice(camera_base.CameraDevice):
         hardware_source = HardwareSource.HardwareSourceManager().get_hardware_source_for_hardware_source_id(
             self.camera_id)
 
+        if self.chrono_ring is not None:
+            self.chrono_ring.close()
+        self.chrono_ring = None
         if "Chrono" in self.current_camera_settings.acquisition_mode:
-            if self.current_camera_settings.acquisition_mode == '2D-Chrono':
-                self.sizez = self.current_camera_settings.spectra_count
-                self.spimimagedata = numpy.zeros((self.sizez, self.sizey, self.sizex), dtype=numpy.float32)
+            is2d = self.current_camera_settings.acquisition_mode == '2D-Chrono'
+            # In ring mode the camera loops on a single frame spim, each frame is appended to the ring on unlock.
+            ring = self.current_camera_settings.chrono_ring and not self.isTimepix
+            depth = 1 if ring else self.current_camera_settings.spectra_count
+            dtype = storage_dtype(self.current_camera_settings.storage_dtype,
+                                  1 if is2d and self.sizey == image_rows else image_rows)
+            if is2d:
+                self.sizez = depth
+                self.spimimagedata = numpy.zeros((self.sizez, self.sizey, self.sizex), dtype=dtype)
             else:
-                self.sizey = self.current_camera_settings.spectra_count
+                self.sizey = depth
                 self.sizez = 1
-                self.spimimagedata = numpy.zeros((self.sizey, self.sizex), dtype=numpy.float32)
+                self.spimimagedata = numpy.zeros((self.sizey, self.sizex), dtype=dtype)
             self.spimimagedata_ptr = self.spimimagedata.ctypes.data_as(ctypes.c_void_p)
+            if ring:
+                self.chrono_ring = ChronoRing(self.current_camera_settings.spectra_count, self.spimimagedata.shape[1:],
+                                              dtype=dtype, directory=self.current_camera_settings.chrono_path or None)
             self.camera.stopFocus()
-            self.camera.startSpim(self.current_camera_settings.spectra_count, 1,
-                                  self.current_camera_settings.exposure_ms / 1000.,
-                                  self.current_camera_settings.acquisition_mode == "2D-Chrono")
+            self.camera.startSpim(depth, 1, self.current_camera_settings.exposure_ms / 1000., is2d)
             self.camera.resumeSpim(4)
-            if self.current_camera_settings.acquisition_mode == "1D-Chrono-Live":
+            if self.current_camera_settings.acquisition_mode == "1D-Chrono-Live" or ring:
                 self.camera.setSpimMode(1)
 
         elif "Focus" in self.current_camera_settings.acquisition_mode and self.__acqspimon:
 
             self.sizey = self.__x_pix_spim
             self.sizez = self.__y_pix_spim
-            self.spimimagedata = numpy.zeros((self.sizez, self.sizey, self.sizex), dtype=numpy.float32)
+            self.spimimagedata = numpy.zeros((self.sizez, self.sizey, self.sizex),
+                                             dtype=storage_dtype(self.current_camera_settings.storage_dtype, image_rows))
             self.spimimagedata_ptr = self.spimimagedata.ctypes.data_as(ctypes.c_void_p)
+            if self.current_camera_settings.get("spim_stream_path"):
+                self.spim_writer = SpimStreamWriter(
+                    os.path.join(self.current_camera_settings.spim_stream_path,
+                                 time.strftime(f"{self.camera_type}_spim_%Y%m%d_%H%M%S")), self.spimimagedata)
             self.camera.stopFocus()
             self.camera.startSpim(self.__x_pix_spim * self.__y_pix_spim, 1,
                                   self.current_camera_settings.exposure_ms / 1000.,
@@ -367,15 +1057,34 @@ class CameraDevice(camera_base.CameraDevice):
             self.sizez = 1
             acqmode = 0
             sb = "1d" if self.current_camera_settings.soft_binning else "2d"
+            self.cumul = None
             if self.current_camera_settings.acquisition_mode == "Cumul":
-                acqmode = 1
-            self.imagedata = numpy.zeros((self.sizey, self.sizex), dtype=numpy.float32)
-            self.imagedata_ptr = self.imagedata.ctypes.data_as(ctypes.c_void_p)
+                if self.current_camera_settings.get("cumul_rejection") and not self.isTimepix:
+                    # the camera runs Focus, frames are summed here with outlier rejection
+                    self.cumul = CumulAccumulator((self.sizey, self.sizex), self.current_camera_settings.cumul_rejection,
+                                                  self.current_camera_settings.cumul_k,
+                                                  self.current_camera_settings.cumul_sigma)
+                else:
+                    acqmode = 1
+            if self.isTimepix:
+                self.frame_pool = None
+                self.imagedata = numpy.zeros((self.sizey, self.sizex), dtype=numpy.float32)
+                self.imagedata_ptr = self.imagedata.ctypes.data_as(ctypes.c_void_p)
+            else:
+                # Cumul sums in the buffer it is given, so it keeps a single one.
+                self.frame_pool = FrameBufferPool(1 if acqmode else FRAME_BUFFERS, (self.sizey, self.sizex))
+                self.imagedata = self.frame_pool.buffers[0]
+                self.imagedata_ptr = self.frame_pool.pointers[0]
             self.__acqon = self.camera.startFocus(self.current_camera_settings.exposure_ms / 1000, sb, acqmode)
 
+        if self.ccd_status is not None:  # spim and chrono end in their unlocker, which stops playing itself
+            self.ccd_status.start(self.current_camera_settings.acquisition_mode in ("Focus", "Cumul")
+                                  and not self.__acqspimon)
         self._last_time = time.time()
 
     def stop_live(self) -> None:
+        if self.ccd_status is not None:
+            self.ccd_status.stop()
         if self.__acqon:
             self.camera.stopFocus()
             self.__acqon = False
@@ -386,19 +1095,43 @@ class CameraDevice(camera_base.CameraDevice):
             self.__acqon = False
             self.__acqspimon = False
             logging.info('***CAMERA***: Spim stopped. Handling...')
+            if self.chrono_ring is not None:
+                self.chrono_ring.close()
             if not "Chrono" in self.current_camera_settings.acquisition_mode \
                     and not "SpimTP" in self.current_camera_settings.acquisition_mode:
+                self.set_spim_slave(False)
+                if self.spim_writer is not None:
+                    self.spim_writer.close()
+                    self.spim_writer = None
+                self.instrument.warn_Camera_spim_done(self.camera_id, self.spimimagedata)
                 self.instrument.warn_Scan_instrument_spim(False)
 
+    def set_spim_slave(self, value: bool) -> None:
+        """
+        In a two cameras spim, the camera not clocking the scan has its exposures triggered externally.
+        """
+        if self.isTimepix or value == self.__spim_slave:
+            return
+        self.__spim_slave = value
+        self.camera.setExposureMode(1 if value else 0, 0)
+
     def acquire_image(self) -> dict:
         acquisition_mode = self.current_camera_settings.acquisition_mode
+        pending = 0
         if "Chrono" in acquisition_mode:
             self.has_spim_data_event.wait(1.0)
             self.has_spim_data_event.clear()
-            self.acquire_data = self.spimimagedata
+            if self.chrono_ring is not None:
+                self.acquire_data = self.chrono_ring.view()
+            else:
+                self.acquire_data = self.spimimagedata
             if "2D" in acquisition_mode:
                 collection_dimensions = 1
                 datum_dimensions = 2
+            elif self.current_camera_settings.zlp_align:
+                self.acquire_data = self.align_chrono()
+                collection_dimensions = 0
+                datum_dimensions = 1
             else:
                 collection_dimensions = 1
                 datum_dimensions = 2
@@ -421,22 +1154,64 @@ class CameraDevice(camera_base.CameraDevice):
             self.has_spim_data_event.clear()
 
         else:  # Cumul and Focus
-            self.has_data_event.wait(1.0)  # wait until True
+            new_frame = self.has_data_event.wait(1.0)  # wait until True
             self.has_data_event.clear()  # Puts back false
-            self.acquire_data = self.imagedata
+            if self.cumul is not None:
+                self.acquire_data = self.__add_cumul_frames()
+            elif self.frame_pool is not None:
+                frame, pending = self.frame_pool.acquire()
+                while frame is None and self.__delivered is None and self.__acqon:  # nothing delivered yet
+                    self.has_data_event.wait(1.0)
+                    self.has_data_event.clear()
+                    frame, pending = self.frame_pool.acquire()
+                if pending:
+                    self.has_data_event.set()
+                if frame is not None:  # corrected once, when taken from the ready queue
+                    self.__delivered = self.__correct(frame)
+                self.acquire_data = self.__delivered
+            else:
+                if new_frame or self.__delivered is None:
+                    self.__delivered = self.__correct(self.imagedata)
+                self.acquire_data = self.__delivered
+            strips = self.current_camera_settings.strips
             if self.acquire_data.shape[0] == 1:  # fully binned
                 collection_dimensions = 1
                 datum_dimensions = 1
                 if self.current_camera_settings.flipped:
                     self.acquire_data = numpy.flip(self.acquire_data[0], 0)
+            elif strips:  # one spectrum per strip
+                self.acquire_data = self.__extract_strips(self.acquire_data, strips)
+                collection_dimensions = 1
+                datum_dimensions = 1
+                if self.current_camera_settings.flipped:
+                    self.acquire_data = numpy.flip(self.acquire_data, 1)
             else:  # not binned
                 collection_dimensions = 0
                 datum_dimensions = 2
 
+        # only plain Focus can miss frames, the other modes keep every frame in their buffer or sum
+        latency = self.metrics.delivered(pending, accumulating=acquisition_mode != "Focus" or self.__acqspimon)
+
         properties = dict()
         properties["frame_number"] = self.frame_number
         properties["acquisition_mode"] = acquisition_mode
+        properties["latency_ms"] = latency
+        properties["missed_frames"] = self.metrics.missed_frames
+        if "Chrono" in acquisition_mode and self.chrono_ring is not None:
+            properties["chrono_frames"] = self.chrono_ring.count
+        if self.zlp_drift is not None and "Chrono" in acquisition_mode:
+            properties["zlp_drift"] = self.zlp_drift.tolist()
+        if self.strip_extractor is not None and self.acquire_data.ndim == 2 and \
+                self.acquire_data.shape[0] == len(self.strip_extractor.strips):
+            properties["strips"] = self.strip_extractor.strips
+        if acquisition_mode == "Cumul" and self.cumul is not None:
+            properties["frame_number"] = self.cumul.count
+            properties["rejected_pixels"] = self.cumul.rejected
         calibration_controls = copy.deepcopy(self.calibration_controls)
+        if "SpimTP" in acquisition_mode:
+            properties["tp3roi"] = tuple(self.current_camera_settings.tp3roi)
+            properties["tp3bin"] = self.current_camera_settings.tp3bin
+            calibration_controls.update(self.__energy_calibration())
 
         # if self.frame_number>=self.current_camera_settings.spectra_count and acquisition_mode=='Cumul':
         #    self.stop_acquitisition_event.fire("")
@@ -459,6 +1234,24 @@ class CameraDevice(camera_base.CameraDevice):
             "counts_per_electron_value": 1
         }
 
+    def __energy_calibration(self) -> dict:
+        """
+        Energy calibration of a SPIM cropped and binned at ingestion. Scale and offset are read from the instrument
+        and given as values so the first channel of the ROI keeps its energy.
+        """
+        start = self.current_camera_settings.tp3roi[0]
+        binning = self.current_camera_settings.tp3bin
+        valid_scale, scale = self.instrument.TryGetVal(self.camera_type + "_x_scale")
+        valid_offset, offset = self.instrument.TryGetVal(self.camera_type + "_x_offset")
+        if not valid_scale:
+            return dict()
+        return {
+            "x_scale_control": None,
+            "x_offset_control": None,
+            "x_scale_value": scale * binning,
+            "x_offset_value": (offset if valid_offset else 0) + start * scale,
+        }
+
     @property
     def processing(self) -> typing.Optional[str]:
         return self.__processing
@@ -493,6 +1286,68 @@ class CameraDevice(camera_base.CameraDevice):
     def readoutTime(self) -> float:
         return self.camera.getReadoutTime()
 
+    def plan_readout(self, target_rate=None, soft_binning=False, areas=None, h_binnings=None, v_binnings=None):
+        """
+        Find the port, speed, area and binning giving the fastest frame rate, or, with a target_rate (Hz), the one
+        keeping the most pixels among those reaching it. Frame time is exposure plus readout, readout being modeled as
+        a row shift time for every sensor row in the area plus the port/speed pixel time for every binned pixel. The row
+        shift time is calibrated from getReadoutTime() in the current configuration.
+
+        areas, h_binnings and v_binnings are the candidates, defaults are the current area and binnings. With
+        soft_binning, only configurations giving a spectrum are considered, the full vertical binning being done in
+        hardware when possible. Returns the frame parameters to apply in one set_current_frame_parameters, together
+        with the predicted readout time and frame rate, or None if no candidate is valid. Turbo mode is left as it is,
+        its gain is not part of the DLL pixel time.
+        """
+        settings = self.current_camera_settings
+        areas = areas if areas else [settings.area]
+        h_binnings = h_binnings if h_binnings else [settings.h_binning]
+        v_binnings = v_binnings if v_binnings else [settings.v_binning]
+        ports = range(self.camera.getNumofPorts())
+        pixel_times = {(port, speed): self.camera.getPixelTime(port, speed) * 1e-9
+                       for port in ports for speed in range(self.camera.getNumofSpeeds(port))}
+
+        def shape(area, hb, vb):
+            rows, cols = int(area[2] - area[0]), int(area[3] - area[1])
+            return rows, max(rows // vb, 1), max(cols // hb, 1)
+
+        rows, rows_out, cols_out = shape(settings.area, settings.h_binning, settings.v_binning)
+        pixel_time = pixel_times.get((settings.port, settings.speed), 0)
+        row_time = max(self.camera.getReadoutTime() - rows_out * cols_out * pixel_time, 0) / max(rows, 1)
+
+        plans = list()
+        for area in areas:
+            for hb in h_binnings:
+                for vb in v_binnings + ([int(area[2] - area[0])] if soft_binning else []):
+                    rows, rows_out, cols_out = shape(area, hb, vb)
+                    if vb > rows:
+                        continue
+                    for (port, speed), pixel_time in pixel_times.items():
+                        readout = rows * row_time + rows_out * cols_out * pixel_time
+                        plans.append({
+                            "frame_parameters": {"port": port, "speed": speed, "area": tuple(area),
+                                                 "h_binning": hb, "v_binning": vb,
+                                                 "soft_binning": soft_binning and rows_out > 1},
+                            "readout_time": readout,
+                            "frame_rate": 1 / (settings.exposure_ms / 1000 + readout),
+                            "pixels": (1 if soft_binning else rows_out) * cols_out,
+                            "rows": rows,
+                        })
+        if not plans:
+            return None
+        fastest = max(plans, key=lambda plan: plan["frame_rate"])
+        if target_rate:
+            reaching = [plan for plan in plans if plan["frame_rate"] >= target_rate]
+            if reaching:
+                # most pixels, then the largest area (signal for spectra), then the fastest
+                return max(reaching, key=lambda plan: (plan["pixels"], plan["rows"], -plan["readout_time"]))
+            logging.info(f"***CAMERA***: {target_rate} Hz is out of reach, fastest is {fastest['frame_rate']:.1f} Hz")
+        return fastest
+
+    def get_acquisition_metrics(self) -> typing.Dict:
+        """Latency histogram, missed frames and rates since the last start_live."""
+        return self.metrics.as_dict()
+
     def get_acquire_sequence_metrics(self, camera_frame_parameters: typing.Dict) -> typing.Dict:
         acquisition_frame_count = camera_frame_parameters.get("acquisition_frame_count")
         storage_frame_count = camera_frame_parameters.get("storage_frame_count")
@@ -508,6 +1363,216 @@ class CameraDevice(camera_base.CameraDevice):
         return {"acquisition_time": acquisition_time, "acquisition_memory": acquisition_memory,
                 "storage_memory": storage_memory}
 
+    def acquire_sequence(self, n: int) -> typing.Optional[typing.Dict]:
+        """
+        Streams n Focus frames into a single preallocated array. With the 'sum_project' processing each frame is
+        summed along its rows as it arrives, so only the n spectra are kept. sequence_progress_event is fired with
+        (frames done, n) after every frame. Returns None if cancelled.
+        """
+        settings = self.current_camera_settings
+        acquisition_mode = settings.acquisition_mode
+        sum_project = settings.get("processing") == "sum_project"
+        data = None
+        count = 0
+        self.__sequence_cancel.clear()
+        self.has_data_event.clear()
+        settings.acquisition_mode = "Focus"
+        self.start_live()
+        try:
+            while count < n:
+                if self.__sequence_cancel.is_set():
+                    logging.info(f"***CAMERA***: Sequence cancelled after {count} frames out of {n}.")
+                    return None
+                if not self.has_data_event.wait(1.0):
+                    continue
+                self.has_data_event.clear()
+                if self.frame_pool is not None:
+                    frame, pending = self.frame_pool.acquire()
+                    if frame is None:
+                        continue
+                    if pending:
+                        self.has_data_event.set()
+                else:
+                    frame = self.imagedata
+                frame = self.__correct(frame)
+                if frame.shape[0] == 1:  # fully binned
+                    frame = numpy.flip(frame[0], 0) if settings.flipped else frame[0]
+                if data is None:
+                    shape = frame.shape[1:] if sum_project and frame.ndim > 1 else frame.shape
+                    data = numpy.empty((n,) + shape, dtype=frame.dtype)
+                if sum_project and frame.ndim > 1:
+                    numpy.sum(frame, axis=0, out=data[count])
+                else:
+                    data[count] = frame
+                count += 1
+                self.sequence_progress_event.fire(count, n)
+        finally:
+            self.stop_live()
+            settings.acquisition_mode = acquisition_mode
+
+        properties = dict()
+        properties["frame_number"] = self.frame_number
+        properties["acquisition_mode"] = acquisition_mode
+        properties["processing"] = settings.get("processing")
+        return {"data": data, "calibration_controls": copy.deepcopy(self.calibration_controls),
+                "properties": properties}
+
+    def acquire_sequence_cancel(self) -> None:
+        self.__sequence_cancel.set()
+
+    def __hdr_exposures(self):
+        settings = self.current_camera_settings
+        return sorted(settings.hdr_exposures_ms or
+                      (settings.exposure_ms / 100, settings.exposure_ms / 10, settings.exposure_ms))
+
+    def measure_hdr_darks(self, count: int = 20) -> bool:
+        """
+        Measures the dark reference of every HDR exposure, per pixel (soft binning off) as acquire_hdr needs them.
+        The beam must be blanked.
+        """
+        settings = self.current_camera_settings
+        exposure_ms, soft_binning = settings.exposure_ms, settings.soft_binning
+        settings.soft_binning = False
+        try:
+            for exposure in self.__hdr_exposures():
+                settings.exposure_ms = exposure
+                self.camera.setExposureTime(exposure / 1000.)
+                if not self.measure_correction("dark", count):
+                    return False
+        finally:
+            settings.exposure_ms, settings.soft_binning = exposure_ms, soft_binning
+            self.camera.setExposureTime(exposure_ms / 1000.)
+        return True
+
+    def acquire_hdr(self, count: int = 1) -> typing.Optional[typing.Dict]:
+        """
+        High dynamic range acquisition. Each exposure of hdr_exposures_ms is acquired as a sequence of count raw
+        frames (acquire_sequence, soft binning and correction off) and the sequences are merged frame by frame with
+        merge_hdr, so count > 1 gives a stacked chrono of merged frames. Saturation is checked per pixel (hardware
+        binned), then the dark of each exposure (measure_hdr_darks) is subtracted, and rows are summed afterwards if
+        soft binning is on. Returns None if cancelled or if a dark is missing.
+        """
+        settings = self.current_camera_settings
+        exposures = self.__hdr_exposures()
+        exposure_ms, soft_binning = settings.exposure_ms, settings.soft_binning
+        correction, processing = settings.get("correction"), settings.get("processing")
+        sequences, darks = list(), list()
+        settings.soft_binning = False
+        settings.correction, settings.processing = FrameCorrection.NONE, None
+        try:
+            for exposure in exposures:
+                settings.exposure_ms = exposure
+                dark = self.correction.darks.get(FrameCorrection.dark_key(settings))
+                if dark is None:
+                    logging.info(f"***CAMERA***: No dark reference at {exposure} ms without soft binning, "
+                                 f"measure the HDR darks first.")
+                    return None
+                self.camera.setExposureTime(exposure / 1000.)
+                sequence = self.acquire_sequence(count)
+                if sequence is None:
+                    return None
+                data = sequence["data"]
+                if data.ndim == 2:  # fully binned spectra come out flipped and squeezed, the dark is not
+                    dark = dark[0][::-1] if settings.flipped else dark[0]
+                sequences.append(data)
+                darks.append(dark)
+        finally:
+            settings.exposure_ms, settings.soft_binning = exposure_ms, soft_binning
+            settings.correction, settings.processing = correction, processing
+            self.camera.setExposureTime(exposure_ms / 1000.)
+
+        data, saturated = merge_hdr(sequences, exposures, settings.hdr_saturation, darks)
+        if correction in (FrameCorrection.GAIN, FrameCorrection.BOTH):
+            gain = self.correction.gains.get(FrameCorrection.gain_key(settings)[:-1] + (False,))
+            if gain is not None and gain.shape == data.shape[1:]:
+                data *= gain
+        if soft_binning and data.ndim == 3:  # rows summed once the pixels are merged
+            data = data.sum(axis=1)
+            if settings.flipped:
+                data = numpy.flip(data, 1)
+        if count == 1:
+            data = data[0]
+        logging.info(f"***CAMERA***: HDR of {len(exposures)} exposures, {saturated} pixels saturated in all of them.")
+        properties = dict()
+        properties["acquisition_mode"] = settings.acquisition_mode
+        properties["exposure_ms"] = max(exposures)
+        properties["hdr_exposures_ms"] = exposures
+        properties["saturated_pixels"] = saturated
+        return {"data": data, "collection_dimension_count": 1 if count > 1 else 0,
+                "datum_dimension_count": data.ndim - (1 if count > 1 else 0),
+                "calibration_controls": copy.deepcopy(self.calibration_controls), "properties": properties}
+
+    def align_chrono(self, stack=None):
+        """
+        ZLP aligned sum of a 1D chrono, the live one (ring or buffer) if no stack is given. The drift of each spectrum
+        is kept in zlp_drift.
+        """
+        if stack is None:
+            if self.chrono_ring is not None:
+                stack = self.chrono_ring.view()[:min(self.chrono_ring.count, self.chrono_ring.depth)]
+            else:
+                stack = self.spimimagedata
+            stack = stack.reshape(stack.shape[0], -1)
+        settings = self.current_camera_settings
+        aligned, self.zlp_drift = align_zlp(stack, settings.zlp_align or ZLP_CENTROID, settings.zlp_fourier)
+        return aligned
+
+    def __extract_strips(self, frame, strips):
+        rows = frame.shape[0]
+        strips = [tuple(strip) for strip in strips]
+        extractor = self.strip_extractor
+        if extractor is None or extractor.rows != rows or extractor.requested != strips:
+            extractor = self.strip_extractor = StripExtractor(strips, rows)
+        return extractor.extract(frame)
+
+    def __add_cumul_frames(self):
+        """
+        Adds every frame waiting in the pool to the host side Cumul, so none is skipped, and returns the sum.
+        """
+        settings = self.current_camera_settings
+        count = self.cumul.count
+        while self.frame_pool.ready:
+            frame, pending = self.frame_pool.acquire()
+            if settings.get("correction"):
+                frame = self.correction.apply(frame, settings, settings.correction)
+            self.cumul.add(frame)
+        if count < settings.spectra_count <= self.cumul.count:
+            self.stop_acquitisition_event.fire("")
+        return self.cumul.sum()
+
+    def __correct(self, frame):
+        settings = self.current_camera_settings
+        if not settings.get("correction"):
+            return frame
+        cumul = settings.acquisition_mode == "Cumul"
+        # Cumul accumulates in the buffer, it must not be corrected in place
+        return self.correction.apply(frame, settings, settings.correction, self.frame_number if cumul else 1,
+                                     settings.get("correction_float") or cumul)
+
+    def measure_correction(self, reference: str, count: int = 20) -> bool:
+        """
+        Acquires count Focus frames and stores their mean as 'dark' (beam blanked) or 'flat' (uniform illumination)
+        reference for the current exposure, binning and area. Frames are not corrected while measuring.
+        """
+        settings = self.current_camera_settings
+        correction, processing = settings.get("correction"), settings.get("processing")
+        settings.correction, settings.processing = FrameCorrection.NONE, None
+        try:
+            sequence = self.acquire_sequence(count)
+        finally:
+            settings.correction, settings.processing = correction, processing
+        if sequence is None:
+            return False
+        mean = sequence["data"].mean(axis=0)
+        if mean.ndim == 1:  # spectra come out of acquire_sequence flipped and squeezed, raw frames are not
+            mean = (mean[::-1] if settings.flipped else mean)[numpy.newaxis]
+        if reference == "dark":
+            self.correction.set_dark(settings, mean)
+        else:
+            self.correction.set_flat(settings, mean)
+        logging.info(f"***CAMERA***: {reference} reference measured for {FrameCorrection.dark_key(settings)}")
+        return True
+
     def sendMessageFactory(self):
         """
         Notes
@@ -532,6 +1597,12 @@ class CameraDevice(camera_base.CameraDevice):
         For message==2, it is exactly the same. Difference is simply dimensionality (datum and collection dimensions) and,
         if array is complete, i double the size in order to always show more data. A personal choice to never limit data
         arrival.
+
+        Message==4 is sent at the end of a drift corrected SPIM. The corrected SPIM is handed to the instrument so it
+        can be displayed as a new data item.
+
+        Message==5 is sent when the SPIM has been copied out of the ingestion shared memory. The views of the shared
+        cube are replaced by the copy so the memory can be released.
         """
 
         def sendMessage(message):
@@ -543,13 +1614,24 @@ class CameraDevice(camera_base.CameraDevice):
                 self.current_event.fire(
                     format(self.camera.get_current(self.imagedata, self.frame_number), ".5f")
                 )
+                self.metrics.unlocked()
                 self.has_data_event.set()
 
             elif message == 2:
                 self.frame_number += 1
                 self.spimimagedata = self.camera.create_spimimage_from_events()
+                self.metrics.unlocked()
                 self.has_spim_data_event.set()
 
+            elif message == 4:
+                self.spimimagedata = self.camera.create_spimimage_from_events()
+                self.instrument.warn_Camera_spim_over(numpy.copy(self.spimimagedata), 'Drift Corrected Spim')
+
+            elif message == 5:
+                if self.acquire_data is self.spimimagedata:
+                    self.acquire_data = None
+                self.spimimagedata = self.camera.create_spimimage_from_events()
+
         return sendMessage
 
 
@@ -577,6 +1659,24 @@ class CameraFrameParameters(dict):
         self.timeDelay = self.get("timeDelay", 0)
         self.timeWidth = self.get("timeWidth", 0)
         self.tp3mode = self.get("tp3mode", 0)
+        self.tp3drift = self.get("tp3drift", False)
+        self.tp3roi = self.get("tp3roi", (0, 1025))
+        self.tp3bin = self.get("tp3bin", 1)
+        self.tp3process = self.get("tp3process", False)
+        self.chrono_ring = self.get("chrono_ring", False)
+        self.chrono_path = self.get("chrono_path", "")
+        self.correction = self.get("correction", 0)  # 0 none, 1 readout (dark), 2 gain, 3 both
+        self.correction_float = self.get("correction_float", False)
+        self.spim_stream_path = self.get("spim_stream_path", "")
+        self.cumul_rejection = self.get("cumul_rejection", 0)  # 0 in the camera, 1 sigma clipping, 2 median of k
+        self.cumul_k = self.get("cumul_k", 5)
+        self.cumul_sigma = self.get("cumul_sigma", 5.)
+        self.zlp_align = self.get("zlp_align", 0)  # 1D chrono: 0 stack, 1 centroid, 2 parabola aligned sum
+        self.zlp_fourier = self.get("zlp_fourier", False)
+        self.hdr_exposures_ms = self.get("hdr_exposures_ms", [])  # empty: exposure_ms / 100, / 10 and exposure_ms
+        self.hdr_saturation = self.get("hdr_saturation", 65000)
+        self.storage_dtype = self.get("storage_dtype", "float32")  # chrono and spim buffers, see STORAGE_DTYPES
+        self.strips = self.get("strips", [])  # [(first row, last row + 1), ...]. Several spectra from a 2D frame
         self.integration_count = 1  # required
 
     def __copy__(self):
@@ -615,6 +1715,24 @@ class CameraFrameParameters(dict):
             "timeDelay": self.timeDelay,
             "timeWidth": self.timeWidth,
             "tp3mode": self.tp3mode,
+            "tp3drift": self.tp3drift,
+            "tp3roi": self.tp3roi,
+            "tp3bin": self.tp3bin,
+            "tp3process": self.tp3process,
+            "chrono_ring": self.chrono_ring,
+            "chrono_path": self.chrono_path,
+            "correction": self.correction,
+            "correction_float": self.correction_float,
+            "spim_stream_path": self.spim_stream_path,
+            "cumul_rejection": self.cumul_rejection,
+            "cumul_k": self.cumul_k,
+            "cumul_sigma": self.cumul_sigma,
+            "strips": self.strips,
+            "zlp_align": self.zlp_align,
+            "zlp_fourier": self.zlp_fourier,
+            "hdr_exposures_ms": self.hdr_exposures_ms,
+            "hdr_saturation": self.hdr_saturation,
+            "storage_dtype": self.storage_dtype,
         }
 
 
@@ -341,6 +341,12 @@ class orsayCamera(object):
         """
         self.__OrsayCameraRegisterSpimDataUnlocker(self.orsaycamera, fn)
 
+    def registerSpimUpdateInfo(self, fn):
+        """
+        Function called with the current spectrum number while a spectrum image is acquired
+        """
+        self.__OrsayCameraRegisterSpimUpdateLocker(self.orsaycamera, fn)
+
     def registerSpectrumDataLocker(self, fn):
        """
        Function called to get data storage for the current spectrum in spim readout
@@ -775,4 +781,94 @@ class orsayCamera(object):
 
     def setCCDOverscan(self, sx, sy):
         self.__OrsayCameraSetCCDOverscan(self.orsaycamera, sx, sy)
-        
\ No newline at end of file
+        
+
+class orsayCameraMirror(object):
+    """
+    State mirror around an orsayCamera.
+    Static capabilities (sensor size, ports, speeds, gains) are read once from the DLL, and the setters only reach the
+    DLL when the value differs from the last one applied. Everything else goes straight to the camera.
+    """
+    STATIC = ("getCCDSize", "getNumofPorts", "getPortName", "getPortNames", "getNumofSpeeds", "getSpeeds",
+              "getPixelTime", "getNumofGains", "getGains", "getGainName")
+
+    def __init__(self, camera: orsayCamera):
+        self.camera = camera
+        self.skipped = 0
+        self.__static = dict()
+        self.__applied = dict()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.camera, name)
+        if name not in self.STATIC:
+            return attribute
+
+        def cached(*args):
+            key = (name, args)
+            if key not in self.__static:
+                self.__static[key] = attribute(*args)
+            return self.__static[key]
+        return cached
+
+    def __apply(self, key, value, setter, *args):
+        if key in self.__applied and self.__applied[key] == value:
+            self.skipped += 1
+            return None
+        result = setter(*args)
+        self.__applied[key] = value
+        return result
+
+    def invalidate(self, *keys):
+        """
+        Forget the last applied values (all of them without keys), next setter calls will reach the DLL
+        """
+        if keys:
+            for key in keys:
+                self.__applied.pop(key, None)
+        else:
+            self.__applied.clear()
+
+    def setAccumulationNumber(self, count):
+        return self.__apply("accumulation", count, self.camera.setAccumulationNumber, count)
+
+    def setVideoThreshold(self, threshold):
+        return self.__apply("video_threshold", threshold, self.camera.setVideoThreshold, threshold)
+
+    def setFan(self, On_Off: bool):
+        return self.__apply("fan", bool(On_Off), self.camera.setFan, On_Off)
+
+    def setExposureTime(self, exposure):
+        return self.__apply("exposure", exposure, self.camera.setExposureTime, exposure)
+
+    def setMultiplication(self, multiplication):
+        return self.__apply("multiplication", multiplication, self.camera.setMultiplication, multiplication)
+
+    def setGain(self, gain):
+        return self.__apply("gain", gain, self.camera.setGain, gain)
+
+    def setCurrentPort(self, cameraport):
+        if self.__applied.get("port") != cameraport:
+            self.invalidate("speed", "gain", "multiplication")
+        return self.__apply("port", cameraport, self.camera.setCurrentPort, cameraport)
+
+    def setSpeed(self, cameraport, speed):
+        return self.__apply("speed", (cameraport, speed), self.camera.setSpeed, cameraport, speed)
+
+    def setBinning(self, bx, by):
+        return self.__apply("binning", (bx, by), self.camera.setBinning, bx, by)
+
+    def setArea(self, area: tuple):
+        if self.__applied.get("area") != tuple(area):
+            self.invalidate("binning")
+        return self.__apply("area", tuple(area), self.camera.setArea, area)
+
+    def setTurboMode(self, active, sizex, sizey):
+        return self.__apply("turbo", (active, sizex, sizey), self.camera.setTurboMode, active, sizex, sizey)
+
+    def startFocus(self, exposure, displaymode, accumulate):
+        self.invalidate("exposure")
+        return self.camera.startFocus(exposure, displaymode, accumulate)
+
+    def startSpim(self, nbspectra, nbspectraperpixel, dwelltime, is2D):
+        self.invalidate("exposure")
+        return self.camera.startSpim(nbspectra, nbspectraperpixel, dwelltime, is2D)
@@ -0,0 +1,458 @@
+"""
+Pure python simulation of the orsay camera class.
+
+Same methods as orsaycamera.orsayCamera but no Cameras.dll: a worker thread calls the registered locker and unlocker
+callbacks at the rate the exposure and readout time allow, and fills the buffers they return with synthetic EELS or
+CL data. Used when the library cannot be loaded (not the microscope computer) to run the plugin and its acquisition
+flow anyway.
+"""
+import threading
+import time
+from ctypes import CFUNCTYPE, POINTER, byref, c_bool, c_char, c_char_p, c_int, c_void_p
+
+import numpy
+
+# Same prototypes as the library ones, with the C calling convention available on every platform.
+LOGGERFUNC = CFUNCTYPE(None, c_char_p, c_bool)
+DATALOCKFUNC = CFUNCTYPE(c_void_p, c_int, POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int))
+DATAUNLOCKFUNC = CFUNCTYPE(None, c_int, c_bool)
+SPIMLOCKFUNC = CFUNCTYPE(c_void_p, c_int, POINTER(c_int), POINTER(c_int), POINTER(c_int), POINTER(c_int))
+SPIMUNLOCKFUNC = CFUNCTYPE(None, c_int, c_bool, c_bool)
+SPECTLOCKFUNC = CFUNCTYPE(c_void_p, c_int, POINTER(c_int), POINTER(c_int))
+SPECTUNLOCKFUNC = CFUNCTYPE(None, c_int, c_bool)
+SPIMUPDATEFUNC = CFUNCTYPE(None, c_int, c_bool)
+CONNECTIONFUNC = CFUNCTYPE(None, c_bool, c_bool)
+
+# Orsay data type codes (the spim lockers add 100)
+_DATA_TYPES = {2: numpy.int16, 3: numpy.int32, 6: numpy.uint16, 7: numpy.uint32, 11: numpy.float32, 12: numpy.float64}
+
+# (ccd size, port names, pixel times (ns) per speed, gain names, row shift time (s))
+_MODELS = {
+    "KURO": ((2048, 2048), ("Normal",), (10, 50), ("Low", "High"), 2e-6),
+    "ProEM": ((1600, 200), ("Electron Multiplied", "Normal"), (100, 1000), ("Low", "Medium", "High"), 1e-6),
+}
+_DEFAULT_MODEL = ((1024, 256), ("Normal",), (100, 1000), ("Low", "High"), 2e-6)
+
+# Spim modes: 0:SPIMSTOPPED, 1:SPIMRUNNING, 2:SPIMPAUSED, 3:SPIMSTOPEOL, 4:SPIMSTOPEOF, 5:SPIMONLINE
+SPIMRUNNING = 1
+SPIMPAUSED = 2
+
+UNLOCK_PERIOD = 0.02  # s, a spim is reported at most at this rate, and at the end of every buffer
+
+
+class SyntheticSpectra:
+    """
+    Noise free EELS (zero loss, plasmon and an edge on a power law) or CL (a few luminescence bands) signal, shaped
+    on a sensor of sizex channels. Counts are per second, frames are Poisson sampled with a small drift in energy.
+    """
+
+    def __init__(self, eels=True, intensity=2e6):
+        self.eels = eels
+        self.intensity = intensity
+        self.drift = 0.
+        self.__rng = numpy.random.default_rng()
+
+    def spectrum(self, sizex, shift=0.):
+        x = numpy.arange(sizex, dtype=numpy.float64) - shift
+        if self.eels:
+            zlp = sizex / 10
+            signal = numpy.exp(-0.5 * ((x - zlp) / max(sizex / 800, 1.)) ** 2)
+            signal += 0.08 * numpy.exp(-0.5 * ((x - zlp - sizex / 12) / (sizex / 60)) ** 2)
+            loss = numpy.clip(x - zlp, 1., None)
+            signal += 0.02 * (loss / sizex) ** -1.5 / (sizex / 2) ** 1.5 * (1 + 0.5 * (x > zlp + sizex / 3))
+        else:
+            signal = sum(weight * numpy.exp(-0.5 * ((x - centre * sizex) / (width * sizex)) ** 2)
+                         for centre, width, weight in ((0.3, 0.05, 1.), (0.55, 0.03, 0.6), (0.7, 0.08, 0.3)))
+        return signal / signal.sum()
+
+    def frame(self, sizex, sizey, exposure):
+        """A (sizey, sizex) frame, the signal spread vertically around the middle of the sensor."""
+        self.drift = 0.98 * self.drift + self.__rng.normal(0., 0.2)
+        counts = self.intensity * max(exposure, 1e-4) * self.spectrum(sizex, self.drift)
+        if sizey > 1:
+            rows = numpy.exp(-0.5 * ((numpy.arange(sizey) - sizey / 2) / max(sizey / 10, 1.)) ** 2)
+            counts = numpy.outer(rows / rows.sum(), counts)
+        return self.__rng.poisson(counts).reshape(sizey, sizex) + self.__rng.normal(100., 3., (sizey, sizex))
+
+
+class orsayCamera(object):
+    """
+    Simulated orsay camera, same interface as orsaycamera.orsayCamera.
+    """
+
+    def __init__(self, manufacturer, model, sn, simul):
+        self.manufacturer = manufacturer
+        self.model = model
+        (self.__ccd_size, self.__ports, self.__pixel_times, self.__gain_names, self.__row_time) = next(
+            (description for name, description in _MODELS.items() if name in model), _DEFAULT_MODEL)
+        self.__signal = SyntheticSpectra(eels="ProEM" not in model)
+        self.__area = (0, 0, self.__ccd_size[1], self.__ccd_size[0])
+        self.__binning = (1, 1)
+        self.__port = 0
+        self.__speed = 0
+        self.__gain = 0
+        self.__multiplication = 1
+        self.__accumulation = 10
+        self.__exposure = 0.01
+        self.__exposure_mode = (0, 0)
+        self.__turbo = (0, *self.__ccd_size)
+        self.__fan = True
+        self.__threshold = 0
+        self.__temperature = -50.
+        self.__mirror = False
+        self.__data_locker = self.__data_unlocker = None
+        self.__spim_locker = self.__spim_unlocker = None
+        self.__spim_update = None
+        self.__spectrum_locker = self.__spectrum_unlocker = None
+        self.__status = (0, self.__temperature, self.__temperature)
+        self.__spim = None
+        self.__spim_mode = 0
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.messagesevent = threading.Event()
+        self.dataevent = threading.Event()
+        self.orsaycamera = self
+        print(f"Camera: simulated {model}")
+
+    def close(self):
+        self.__halt()
+        self.orsaycamera = None
+
+    def registerLogger(self, fn):
+        pass
+
+    def addConnectionListener(self, fn):
+        pass
+
+    @property
+    def simulation_mode(self) -> bool:
+        return True
+
+    def getImageSize(self) -> int:
+        top, left, bottom, right = self.__area
+        return (right - left) // self.__binning[0], (bottom - top) // self.__binning[1]
+
+    def getCCDSize(self) -> (int, int):
+        return self.__ccd_size
+
+    def registerDataLocker(self, fn):
+        self.__data_locker = fn
+
+    def registerDataUnlocker(self, fn):
+        self.__data_unlocker = fn
+
+    def registerSpimDataLocker(self, fn):
+        self.__spim_locker = fn
+
+    def registerSpimDataUnlocker(self, fn):
+        self.__spim_unlocker = fn
+
+    def registerSpimUpdateInfo(self, fn):
+        self.__spim_update = fn
+
+    def registerSpectrumDataLocker(self, fn):
+        self.__spectrum_locker = fn
+
+    def registerSpectrumDataUnlocker(self, fn):
+        self.__spectrum_unlocker = fn
+
+    def setCCDOverscan(self, sx, sy):
+        pass
+
+    def displayOverscan(self, displayed):
+        pass
+
+    def adjustOverscan(self, sizex, sizey):
+        pass
+
+    def getBinning(self):
+        return self.__binning
+
+    def setBinning(self, bx, by):
+        self.__binning = (max(int(bx), 1), max(int(by), 1))
+
+    def setMirror(self, mirror):
+        self.__mirror = mirror
+
+    def setAccumulationNumber(self, count):
+        self.__accumulation = count
+
+    def getAccumulateNumber(self):
+        return self.__accumulation
+
+    def setSpimMode(self, mode):
+        self.__spim_mode = mode
+
+    def startSpim(self, nbspectra, nbspectraperpixel, dwelltime, is2D):
+        self.__halt()
+        self.__spim = (int(nbspectra), max(int(nbspectraperpixel), 1), dwelltime, bool(is2D))
+        self.__spim_mode = 0
+
+    def pauseSpim(self):
+        self.__spim_mode = SPIMPAUSED
+
+    def resumeSpim(self, mode):
+        if self.__spim is None:
+            return
+        if self.__thread is None:
+            self.__start(self.__run_spim)
+        self.__spim_mode = mode if mode != SPIMPAUSED else self.__spim_mode
+
+    def stopSpim(self, immediate):
+        self.__halt()
+        self.__spim = None
+        return True
+
+    def isCameraThere(self):
+        return True
+
+    def getTemperature(self):
+        return self.__temperature, True
+
+    def setTemperature(self, temperature):
+        self.__temperature = temperature
+
+    def setupBinning(self):
+        pass
+
+    def startFocus(self, exposure, displaymode, accumulate):
+        """
+        Start imaging displaymode: 1d, 2d  accumulate if images/spectra have to be summed
+        """
+        self.__halt()
+        self.__exposure = exposure
+        self.__start(self.__run_focus, bool(accumulate))
+        return True
+
+    def stopFocus(self):
+        self.__halt()
+        return True
+
+    def setExposureTime(self, exposure):
+        self.__exposure = exposure
+        return True
+
+    def getNumofSpeeds(self, cameraport):
+        return len(self.__pixel_times)
+
+    def getSpeeds(self, cameraport):
+        return [str(1000 / pixeltime) + " MHz" for pixeltime in self.__pixel_times]
+
+    def getCurrentSpeed(self, cameraport):
+        return self.__speed
+
+    def getAllPortsParams(self):
+        return tuple((port, tuple(self.getSpeeds(p)), tuple((gain, self.__gain) for gain in self.__gain_names))
+                     for p, port in enumerate(self.__ports))
+
+    def setSpeed(self, cameraport, speed):
+        self.__speed = speed
+        return True
+
+    def getNumofGains(self, cameraport):
+        return len(self.__gain_names)
+
+    def getGains(self, cameraport):
+        return list(self.__gain_names)
+
+    def getGain(self, cameraport):
+        return self.__gain
+
+    def getGainName(self, cameraport, gain):
+        return self.__gain_names[gain]
+
+    def setGain(self, gain):
+        self.__gain = gain
+        return True
+
+    def getReadoutTime(self):
+        sx, sy = self.getImageSize()
+        return self.__ccd_size[1] * self.__row_time + sx * sy * self.__pixel_times[self.__speed] * 1e-9
+
+    def getNumofPorts(self):
+        return len(self.__ports)
+
+    def getPortName(self, portnb):
+        return self.__ports[portnb]
+
+    def getPortNames(self):
+        return tuple(self.__ports)
+
+    def getCurrentPort(self):
+        return self.__port
+
+    def setCurrentPort(self, cameraport):
+        if isinstance(cameraport, int):
+            self.__port = cameraport
+            return True
+        else:
+            print("cameraport not an integer")
+            return False
+
+    def getMultiplication(self):
+        return self.__multiplication, 1, 1000
+
+    def setMultiplication(self, multiplication):
+        self.__multiplication = multiplication
+
+    def getCCDStatus(self) -> dict():
+        mode, p1, p2 = self.__status
+        status = dict()
+        if mode == 0:
+            status["mode"] = "idle"
+            status["actual temp"] = p1
+            status["target temp"] = p2
+        elif mode == 3:
+            status["mode"] = "focus"
+            status["frames/seconds"] = p1,
+        elif mode == 4:
+            status["mode"] = "cumul"
+            status["accumulation_count"] = p1
+        elif mode == 6 or mode == 5:
+            status["mode"] = "Spectrum imaging"
+            status["current spectrum"] = p1
+            status["total spectra"] = p2
+        return status
+
+    def getReadoutSpeed(self):
+        return 1 / (self.__exposure + self.getReadoutTime())
+
+    def getPixelTime(self, cameraport, speed):
+        return self.__pixel_times[speed]
+
+    def setTurboMode(self, active, sizex, sizey):
+        self.__turbo = (active, sizex, sizey)
+
+    def getTurboMode(self):
+        return self.__turbo
+
+    def setExposureMode(self, mode, edge):
+        self.__exposure_mode = (mode, edge)
+        return True
+
+    def getExposureMode(self):
+        return self.__exposure_mode
+
+    def setPulseMode(self, mode):
+        return True
+
+    def setVerticalShift(self, shift, clear):
+        return True
+
+    def setFan(self, On_Off : bool):
+        self.__fan = On_Off
+        return True
+
+    def getFan(self):
+        return self.__fan
+
+    def setArea(self, area : tuple):
+        self.__area = tuple(int(value) for value in area)
+        return True
+
+    def getArea(self):
+        return self.__area
+
+    def setVideoThreshold(self, threshold):
+        self.__threshold = threshold
+
+    def getVideoThreshold(self):
+        return self.__threshold
+
+    def __start(self, target, *args):
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=target, args=args, daemon=True)
+        self.__thread.start()
+
+    def __halt(self):
+        thread, self.__thread = self.__thread, None
+        if thread is not None:
+            self.__stop.set()
+            if thread is not threading.current_thread():
+                thread.join()
+        self.__status = (0, self.__temperature, self.__temperature)
+
+    @staticmethod
+    def __lock(locker, gene, pointers):
+        """Calls a locker (with pointers output arguments), returns its buffer as a numpy array (sz, sy, sx) or None."""
+        data_type, sx, sy, sz = c_int(), c_int(1), c_int(1), c_int(1)
+        address = locker(gene, *(byref(data_type), byref(sx), byref(sy), byref(sz))[:pointers])
+        if not address:
+            return None
+        dtype = numpy.dtype(_DATA_TYPES.get(data_type.value % 100, numpy.float32))
+        shape = (sz.value, sy.value, sx.value)
+        size = int(numpy.prod(shape))
+        buffer = (c_char * (size * dtype.itemsize)).from_address(address)
+        return numpy.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+    def __frame(self, sx, sy, exposure):
+        frame = self.__signal.frame(sx, sy, exposure)
+        if self.__threshold:
+            frame[frame < self.__threshold] = 0
+        return frame
+
+    def __run_focus(self, accumulate):
+        gene = 0
+        count = 0
+        start = time.perf_counter()
+        while not self.__stop.is_set():
+            period = self.__exposure + self.getReadoutTime()
+            if self.__stop.wait(max(start + (count + 1) * period - time.perf_counter(), 0)):
+                break
+            count += 1
+            self.__status = (4, count, 0) if accumulate else (3, 1 / period, 0)
+            if self.__data_locker is None or self.__data_unlocker is None:
+                continue
+            data = self.__lock(self.__data_locker, gene, 4)
+            if data is not None:
+                # in 1d display mode the locker asks for a single row, the sensor is binned vertically
+                frame = self.__frame(data.shape[2], data.shape[1], self.__exposure)
+                if accumulate and count > 1:
+                    data[0] += frame.astype(data.dtype)
+                else:
+                    data[0] = frame
+            self.__data_unlocker(gene, data is not None)
+
+    def __run_spim(self):
+        gene = 0
+        nbspectra, perpixel, dwelltime, is2d = self.__spim
+        frame_time = max(dwelltime * perpixel, self.getReadoutTime() if is2d else 0)
+        index = 0
+        last_unlock = start = time.perf_counter()
+        while not self.__stop.is_set():
+            if self.__spim_mode == SPIMPAUSED:
+                self.__stop.wait(0.01)
+                start = time.perf_counter() - index * frame_time
+                continue
+            if self.__stop.wait(max(start + (index + 1) * frame_time - time.perf_counter(), 0)):
+                break
+            if self.__spim_locker is None or self.__spim_unlocker is None:
+                break
+            data = self.__lock(self.__spim_locker, gene, 4)
+            if data is None:
+                break
+            position = index % nbspectra
+            exposure = dwelltime * perpixel
+            if is2d:  # one image per spim position, along z
+                data[position % len(data)] = self.__frame(data.shape[2], data.shape[1], exposure)
+            else:  # one spectrum per position, rows of every plane
+                spectrum = self.__frame(data.shape[2], 1, exposure)[0]
+                spectra = data.reshape(-1, data.shape[2])
+                spectra[position % len(spectra)] = spectrum
+                if self.__spectrum_locker is not None and self.__spectrum_unlocker is not None:
+                    live = self.__lock(self.__spectrum_locker, gene, 2)
+                    if live is not None:
+                        live.reshape(-1)[:len(spectrum)] = spectrum[:live.size]
+                    self.__spectrum_unlocker(gene, live is not None)
+            index += 1
+            self.__status = (5, index % nbspectra, nbspectra)
+            finished = index >= nbspectra and self.__spim_mode != SPIMRUNNING
+            if self.__spim_update is not None:
+                self.__spim_update(index, not finished)
+            now = time.perf_counter()
+            if finished or index % nbspectra == 0 or now - last_unlock >= UNLOCK_PERIOD:
+                last_unlock = now
+                self.__spim_unlocker(gene, True, not finished)
+            if finished:
+                self.__status = (0, self.__temperature, self.__temperature)
+                break
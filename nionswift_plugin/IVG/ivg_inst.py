@@ -4,6 +4,7 @@ import logging
 import smtplib
 import os
 import json
+import numpy
 
 from nion.utils import Event
 from nion.swift.model import HardwareSource
@@ -85,6 +86,10 @@ class ivgInstrument(stem_controller.STEMController):
         self.__spim_xpix = 64
         self.__spim_ypix = 64
         self.__spim_sampling = [0, 0]
+        self.__spim_cameras = 1  # cameras running the current spim
+        self.__spim_armed = 0  # cameras that asked for the scan so far
+        self.__spim_master = 0  # 0 EELS, 1 EIRE. Clocks the scan in EELS+EIRE spim
+        self.__dual_spim = None  # camera_id: spim data, collected at the end of an EELS+EIRE spim
 
         ## spim properties attributes END
 
@@ -183,6 +188,15 @@ class ivgInstrument(stem_controller.STEMController):
             pass
 
     def warn_Scan_instrument_spim(self, value, x_pixels=0, y_pixels=0):
+        # With several cameras, scan starts once all of them are armed and stops when the last one is done.
+        if value:
+            self.__spim_armed += 1
+            if self.__spim_armed < self.__spim_cameras:
+                return
+        else:
+            self.__spim_armed = max(self.__spim_armed - 1, 0)
+            if self.__spim_armed > 0:
+                return
         # only set scan pixels if you going to start spim.
         if value: self.__OrsayScanInstrument.scan_device.set_spim_pixels = (x_pixels, y_pixels)
         self.__OrsayScanInstrument.scan_device.set_spim = value
@@ -195,7 +209,44 @@ class ivgInstrument(stem_controller.STEMController):
     def warn_Scan_instrument_spim_over(self, det_data, spim_pixels, detector):
         self.spim_over.fire(det_data, spim_pixels, detector, self.__spim_sampling)
 
+    def warn_Camera_spim_over(self, spim_data, title, metadata=None):
+        self.cam_spim_over.fire(spim_data, title, self.__spim_sampling, metadata)
+
+    def warn_Camera_spim_done(self, camera_id, spim_data):
+        """
+        Collects the spims of an EELS+EIRE acquisition. When both are there, they are concatenated along the spectral
+        axis, sharing the spatial ones, and sent as a single data item.
+        """
+        if self.__dual_spim is None:
+            return
+        self.__dual_spim[camera_id] = numpy.copy(spim_data)
+        if not all(id in self.__dual_spim for id in (self.__EELS, self.__EIRE)):
+            return
+        eels, eire = self.__dual_spim[self.__EELS], self.__dual_spim[self.__EIRE]
+        self.__dual_spim = None
+        if eels.shape[:2] != eire.shape[:2]:
+            logging.info(f'***IVG***: EELS {eels.shape} and EIRE {eire.shape} spims do not match. Not combined.')
+            return
+        metadata = {"dual_spim": {"eels_channels": eels.shape[2], "eire_channels": eire.shape[2],
+                                  "master": "EELS" if self.__spim_master == 0 else "EIRE"}}
+        self.warn_Camera_spim_over(numpy.concatenate((eels, eire), axis=2), 'EELS+EIRE Spim', metadata)
+
+    @property
+    def spim_scan_clock_f(self):
+        """Scan clock input for the current spim: the ready signal of the (slowest) camera."""
+        camera = self.__spim_trigger if self.__spim_trigger != 2 else self.__spim_master
+        return 2 if camera == 0 else 4
+
+    def __spim_frame_time(self, cam):
+        return cam.camera.current_camera_settings.exposure_ms / 1000. + cam.camera.readoutTime
+
+    def __reset_spim_state(self):
+        """Forgets the cubes and arming of a previous (possibly aborted) spim, so they never pair with a new one."""
+        self.__dual_spim = None
+        self.__spim_armed = 0
+
     def start_spim_push_button(self, x_pix, y_pix):
+        self.__reset_spim_state()
         if self.__spim_trigger == 0:
             now_cam = [HardwareSource.HardwareSourceManager().get_hardware_source_for_hardware_source_id(
             self.__EELS)]
@@ -207,9 +258,14 @@ class ivgInstrument(stem_controller.STEMController):
             now_cam = [HardwareSource.HardwareSourceManager().get_hardware_source_for_hardware_source_id(
             self.__EELS), HardwareSource.HardwareSourceManager().get_hardware_source_for_hardware_source_id(
             self.__EIRE)]
-            logging.info(
-                '***IVG***: Both measurement not yet implemented. Please check back later. Using EELS instead.')
-
+            # the slowest camera clocks the scan, the other one is triggered so both see the same pixels
+            self.__spim_master = 0 if self.__spim_frame_time(now_cam[0]) >= self.__spim_frame_time(now_cam[1]) else 1
+            for index, cam in enumerate(now_cam):
+                cam.camera.set_spim_slave(index != self.__spim_master)
+            self.__dual_spim = dict()
+            logging.info(f'***IVG***: EELS+EIRE Spim. {"EELS" if self.__spim_master == 0 else "EIRE"} is master.')
+
+        self.__spim_cameras = len(now_cam)
         for cam in now_cam:
             cam.stop_playing()
             cam.camera._CameraDevice__acqspimon = True
@@ -221,6 +277,7 @@ class ivgInstrument(stem_controller.STEMController):
                 logging.info('**IVG***: Please stop camera before starting spim.')
 
     def stop_spim_push_button(self):
+        self.__reset_spim_state()
         if self.__spim_trigger == 0:
             now_cam = [HardwareSource.HardwareSourceManager().get_hardware_source_for_hardware_source_id(
             self.__EELS)]
@@ -487,10 +544,8 @@ class ivgInstrument(stem_controller.STEMController):
                 now_cam = HardwareSource.HardwareSourceManager().get_hardware_source_for_hardware_source_id(
             self.__EIRE)
             elif self.__spim_trigger == 2:
-                now_cam = HardwareSource.HardwareSourceManager().get_hardware_source_for_hardware_source_id(
-            self.__EELS)
-                logging.info(
-                    '***IVG***: Both measurement not yet implemented. Please check back later. Using EELS instead.')
+                now_cam = max([HardwareSource.HardwareSourceManager().get_hardware_source_for_hardware_source_id(
+                    id) for id in (self.__EELS, self.__EIRE)], key=self.__spim_frame_time)
 
             self.__spim_time = format(((
                                                    now_cam.camera.current_camera_settings.exposure_ms / 1000. + now_cam.camera.readoutTime) * self.__spim_xpix * self.__spim_ypix / 60),
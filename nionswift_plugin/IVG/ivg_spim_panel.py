@@ -38,6 +38,7 @@ class ivgSpimhandler:
         self.property_changed_event_listener=self.instrument.property_changed_event.listen(self.prepare_widget_enable)
         self.busy_event_listener=self.instrument.busy_event.listen(self.prepare_widget_disable)
         self.spim_over_listener = self.instrument.spim_over.listen(self.over_spim)
+        self.cam_spim_over_listener = self.instrument.cam_spim_over.listen(self.over_cam_spim)
 
     async def do_enable(self, enabled=True, not_affected_widget_name_list=None):
         for var in self.__dict__:
@@ -108,6 +109,21 @@ class ivgSpimhandler:
             data_item.define_property("title", 'Spim Image')
             self.event_loop.create_task(self.data_item_show(data_item))
 
+    def over_cam_spim(self, spimdata, title, sampling, metadata=None):
+        calib = Calibration.Calibration()
+        dim_calib = [Calibration.Calibration(), Calibration.Calibration(), Calibration.Calibration()]
+        dim_calib[0].scale = sampling[0]
+        dim_calib[1].scale = sampling[1]
+        dim_calib[0].units = 'nm'
+        dim_calib[1].units = 'nm'
+        xdata = DataAndMetadata.new_data_and_metadata(spimdata.astype(numpy.float32), calib, dim_calib,
+                                                      metadata=metadata,
+                                                      data_descriptor=DataAndMetadata.DataDescriptor(False, 2, 1))
+        data_item = DataItem.DataItem()
+        data_item.set_xdata(xdata)
+        data_item.define_property("title", title)
+        self.event_loop.create_task(self.data_item_show(data_item))
+
     def cancel_spim(self, widget):
         self.instrument.stop_spim_push_button()
         self.start_button.enabled=True
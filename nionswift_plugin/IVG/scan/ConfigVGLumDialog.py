@@ -1,4 +1,5 @@
 from nion.ui import Declarative
+from nion.utils import Converter
 from nion.utils import Event
 from nion.swift.model import HardwareSource
 
@@ -11,6 +12,7 @@ class Handler:
         self.__hadf_pmt = int(self.__OrsayScanInstrument.scan_device.orsayscan.GetPMT(1))
         self.__bf_pmt = int(self.__OrsayScanInstrument.scan_device.orsayscan.GetPMT(0))
         self.__bot_blanker=False
+        self.frames_converter = Converter.IntegerToStringConverter()
 
     @property
     def hadf_gain_pmt(self):
@@ -46,6 +48,70 @@ class Handler:
         else:
             self.__OrsayScanInstrument.scan_device.orsayscan.SetBottomBlanking(0, 0)
 
+    @property
+    def averaging_mode(self):
+        return self.__OrsayScanInstrument.scan_device.averager.mode
+
+    @averaging_mode.setter
+    def averaging_mode(self, value):
+        self.__OrsayScanInstrument.scan_device.averager.mode = value
+        self.property_changed_event.fire("averaging_mode")
+
+    @property
+    def averaging_frames(self):
+        return self.__OrsayScanInstrument.scan_device.averager.frames
+
+    @averaging_frames.setter
+    def averaging_frames(self, value):
+        self.__OrsayScanInstrument.scan_device.averager.frames = max(int(value), 1)
+        self.property_changed_event.fire("averaging_frames")
+
+    @property
+    def lines_averaging(self):
+        return self.__OrsayScanInstrument.scan_device.lines_averaging
+
+    @lines_averaging.setter
+    def lines_averaging(self, value):
+        self.__OrsayScanInstrument.scan_device.lines_averaging = max(int(value), 1)
+        self.property_changed_event.fire("lines_averaging")
+
+    @property
+    def drift_tracking(self):
+        return self.__OrsayScanInstrument.scan_device.drift_tracker.enabled
+
+    @drift_tracking.setter
+    def drift_tracking(self, value):
+        self.__OrsayScanInstrument.scan_device.drift_tracker.enabled = value
+        self.__OrsayScanInstrument.scan_device.drift_tracker.reset()
+        self.property_changed_event.fire("drift_tracking")
+
+    @property
+    def drift_correction(self):
+        return self.__OrsayScanInstrument.scan_device.drift_tracker.correct
+
+    @drift_correction.setter
+    def drift_correction(self, value):
+        self.__OrsayScanInstrument.scan_device.drift_tracker.correct = value
+        self.property_changed_event.fire("drift_correction")
+
+    @property
+    def history_depth(self):
+        return self.__OrsayScanInstrument.scan_device.history_depth
+
+    @history_depth.setter
+    def history_depth(self, value):
+        self.__OrsayScanInstrument.scan_device.history_depth = max(int(value), 0)
+        self.property_changed_event.fire("history_depth")
+
+    @property
+    def history_ram_mb(self):
+        return self.__OrsayScanInstrument.scan_device.history_ram_mb
+
+    @history_ram_mb.setter
+    def history_ram_mb(self, value):
+        self.__OrsayScanInstrument.scan_device.history_ram_mb = max(int(value), 1)
+        self.property_changed_event.fire("history_ram_mb")
+
 class View():
 
     def __init__(self):
@@ -58,7 +124,22 @@ class View():
 
         self.bot_blanker_check_box = ui.create_check_box(name='bot_blanker_check_box', text='Botton Blanker EELS', checked='@binding(bottom_blanker)')
 
-        self.column = ui.create_column(self.hadf_label, self.hadf_gain_slider, ui.create_spacing(25), self.bf_label, self.bf_gain_slider, self.bot_blanker_check_box)
+        self.averaging_combo = ui.create_combo_box(name='averaging_combo', items=['None', 'Recursive', 'Block sum'], current_index='@binding(averaging_mode)')
+        self.averaging_frames = ui.create_line_edit(name='averaging_frames', text='@binding(averaging_frames, converter=frames_converter)')
+        self.averaging_row = ui.create_row(ui.create_label(text='Frame averaging'), self.averaging_combo, self.averaging_frames, spacing=8)
+        self.lines_averaging = ui.create_line_edit(name='lines_averaging', text='@binding(lines_averaging, converter=frames_converter)')
+        self.lines_row = ui.create_row(ui.create_label(text='Lines averaging'), self.lines_averaging, spacing=8)
+
+        self.drift_check_box = ui.create_check_box(name='drift_check_box', text='Drift tracking', checked='@binding(drift_tracking)')
+        self.drift_correct_check_box = ui.create_check_box(name='drift_correct_check_box', text='Follow drift (subscan)', checked='@binding(drift_correction)')
+        self.drift_row = ui.create_row(self.drift_check_box, self.drift_correct_check_box, spacing=8)
+
+        self.history_depth = ui.create_line_edit(name='history_depth', text='@binding(history_depth, converter=frames_converter)')
+        self.history_ram = ui.create_line_edit(name='history_ram', text='@binding(history_ram_mb, converter=frames_converter)')
+        self.history_row = ui.create_row(ui.create_label(text='Frame history'), self.history_depth, ui.create_label(text='RAM (MB)'), self.history_ram, spacing=8)
+
+        self.column = ui.create_column(self.hadf_label, self.hadf_gain_slider, ui.create_spacing(25), self.bf_label, self.bf_gain_slider, self.bot_blanker_check_box,
+                                       ui.create_spacing(25), self.averaging_row, self.lines_row, self.drift_row, self.history_row)
 
 
         self.dialog = ui.create_modeless_dialog(self.column, title="Scan Settings")
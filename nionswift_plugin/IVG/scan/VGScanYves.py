@@ -1,15 +1,18 @@
 # standard libraries
 import copy
+import json
 import math
 import ctypes
 import gettext
 import numpy
+import tempfile
 import threading
 import typing
 import time
 import logging
 
 # local libraries
+from nion.utils import Event
 from nion.utils import Registry
 from nion.utils import Geometry
 from nion.instrumentation import scan_base
@@ -24,10 +27,11 @@ _ = gettext.gettext
 
 
 class Channel:
-    def __init__(self, channel_id: int, name: str, enabled: bool):
+    def __init__(self, channel_id: int, name: str, enabled: bool, source: typing.Optional[int] = None):
         self.channel_id = channel_id
         self.name = name
         self.enabled = enabled
+        self.source = source  # detector channel averaged into this one, None for a detector
         self.data = None
 
 
@@ -43,6 +47,241 @@ class Frame:
         self.data_count = 0
         self.start_time = time.time()
         self.scan_data = None
+        self.image_number = None  # DLL image this frame is read from
+
+
+class ScanBuffer:
+    """
+    Image buffer given to the DLL by the data locker. It is allocated for the largest area used so far, smaller areas
+    get a view on its beginning, so changing the image area or the subscan only allocates (and changes the pointer
+    given to the DLL) when the buffer has to grow.
+    """
+
+    def __init__(self, dtype=numpy.int16):
+        self.dtype = dtype
+        self.buffer = None
+        self.pointer = None
+
+    def view(self, channels: int, sizex: int, sizey: int) -> numpy.ndarray:
+        size = channels * sizex * sizey
+        if self.buffer is None or self.buffer.size < size:
+            self.buffer = numpy.empty(size, dtype=self.dtype)
+            self.pointer = self.buffer.ctypes.data_as(ctypes.c_void_p)
+            logging.info(f'***SCAN***: Scan buffer allocated for {channels} x {sizex} x {sizey} pixels.')
+        return self.buffer[:size].reshape(channels * sizex, sizey)
+
+
+class FrameAverager:
+    """
+    Averages the completed frames of each detector in float32 accumulators, in place.
+    RECURSIVE: exponential average, the mean of the first frames then each new frame weighs 1 / frames.
+    BLOCK: integration (sum) of blocks of frames, the last complete block is the result, the running sum before.
+    """
+    NONE, RECURSIVE, BLOCK = 0, 1, 2
+
+    def __init__(self):
+        self.mode = FrameAverager.NONE
+        self.frames = 4
+        self.__accumulators = dict()
+        self.__results = dict()
+        self.__counts = dict()
+        self.__scratch = dict()
+        self.__settings = (self.mode, self.frames)
+
+    def reset(self):
+        self.__accumulators.clear()
+        self.__results.clear()
+        self.__counts.clear()
+
+    def add(self, source: int, frame: numpy.ndarray) -> numpy.ndarray:
+        if (self.mode, self.frames) != self.__settings:
+            self.reset()
+            self.__settings = (self.mode, self.frames)
+        accumulator = self.__accumulators.get(source)
+        if accumulator is None or accumulator.shape != frame.shape:
+            accumulator = self.__accumulators[source] = numpy.zeros(frame.shape, numpy.float32)
+            self.__scratch[source] = numpy.empty(frame.shape, numpy.float32)
+            self.__results.pop(source, None)
+            self.__counts[source] = 0
+        scratch = self.__scratch[source]
+        count = self.__counts[source] = self.__counts[source] + 1
+        if self.mode == FrameAverager.BLOCK:
+            if count > self.frames:  # new block
+                accumulator[...] = 0
+                count = self.__counts[source] = 1
+            accumulator += frame
+            if count == self.frames:
+                numpy.copyto(self.__results.setdefault(source, scratch), accumulator)
+            return self.__results.get(source, accumulator)
+        weight = 1. / min(count, max(self.frames, 1))
+        numpy.multiply(frame, weight, out=scratch, casting="unsafe")
+        accumulator *= 1. - weight
+        accumulator += scratch
+        return accumulator
+
+    def result(self, source: int) -> typing.Optional[numpy.ndarray]:
+        if self.mode == FrameAverager.BLOCK:
+            return self.__results.get(source, self.__accumulators.get(source))
+        return self.__accumulators.get(source)
+
+
+class DriftTracker:
+    """
+    Measures specimen drift by phase correlation of each new frame with the first one (the reference), to a fraction
+    of a pixel with a parabola through the correlation peak. The normalized cross spectrum is low passed (bandwidth in
+    cycles per pixel) as its high frequencies are mostly noise. The Hann window, the low pass and the reference
+    spectrum are kept for the frame shape. history holds (time, frame number, dy, dx) in pixels, the total drift since the reference, which
+    includes the whole pixel shifts already applied to the scan window (offset).
+    """
+
+    def __init__(self, bandwidth=0.05):
+        self.enabled = False
+        self.correct = False
+        self.bandwidth = bandwidth
+        self.history = list()
+        self.offset = (0, 0)
+        self.__window = None
+        self.__low_pass = None
+        self.__reference = None
+
+    def reset(self):
+        self.history = list()
+        self.offset = (0, 0)
+        self.__reference = None
+
+    def __spectrum(self, frame):
+        frame = numpy.asarray(frame, dtype=numpy.float32)
+        if self.__window is None or self.__window.shape != frame.shape:
+            self.__window = numpy.outer(numpy.hanning(frame.shape[0]), numpy.hanning(frame.shape[1])).astype(numpy.float32)
+            ky, kx = numpy.fft.fftfreq(frame.shape[0])[:, None], numpy.fft.rfftfreq(frame.shape[1])[None, :]
+            self.__low_pass = numpy.exp(-(ky ** 2 + kx ** 2) / (2 * self.bandwidth ** 2))
+            self.__reference = None
+        return numpy.fft.rfft2((frame - frame.mean()) * self.__window)
+
+    def measure(self, frame, frame_number=None) -> typing.Tuple[float, float]:
+        """Returns the shift of frame from the reference corrected by offset (the residual drift), in pixels."""
+        spectrum = self.__spectrum(frame)
+        if self.__reference is None:
+            self.__reference = numpy.conj(spectrum)
+            self.history.append((time.time(), frame_number, float(self.offset[0]), float(self.offset[1])))
+            return 0., 0.
+        cross = spectrum * self.__reference
+        cross *= self.__low_pass / (numpy.abs(cross) + 1e-12)
+        correlation = numpy.fft.irfft2(cross, s=frame.shape)
+        peak = numpy.unravel_index(numpy.argmax(correlation), correlation.shape)
+        shift = list()
+        for axis, size in enumerate(correlation.shape):
+            index = list(peak)
+            values = list()
+            for step in (-1, 0, 1):
+                index[axis] = (peak[axis] + step) % size
+                values.append(correlation[tuple(index)])
+            curvature = values[0] - 2 * values[1] + values[2]
+            fraction = 0.5 * (values[0] - values[2]) / curvature if curvature < 0 else 0.
+            position = peak[axis] + fraction
+            shift.append(float(position - size if position > size / 2 else position))
+        self.history.append((time.time(), frame_number, self.offset[0] + shift[0], self.offset[1] + shift[1]))
+        return shift[0], shift[1]
+
+
+class ScanFrameRing:
+    """
+    The last depth frames of one channel, with their time, frame number and frame parameters.
+
+    The newest frames are kept in RAM, as many as fit in ram_mb, and each one is copied to a memory mapped temporary
+    file (in directory, the system one by default) when its RAM slot is reused, so older frames stay reachable up to
+    depth. Frames are indexed like a list over what is still held, 0 the oldest and -1 the newest. A change of shape
+    or dtype starts the ring over.
+    """
+
+    def __init__(self, depth, ram_mb=256, directory=None):
+        self.depth = max(int(depth), 1)
+        self.ram_mb = ram_mb
+        self.directory = directory
+        self.count = 0
+        self.info = list()  # (time, frame number, frame parameters) of the frames held, oldest first
+        self.__ram = None
+        self.__disk = None
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.info)
+
+    def __allocate(self, frame):
+        slots = int(self.ram_mb * 1024 * 1024 // max(frame.nbytes, 1))
+        slots = min(max(slots, 1), self.depth)
+        self.__ram = numpy.empty((slots, *frame.shape), frame.dtype)
+        self.__disk = None
+        if self.depth > slots:
+            self.__disk = numpy.memmap(tempfile.TemporaryFile(dir=self.directory), dtype=frame.dtype, mode="w+",
+                                       shape=(self.depth - slots, *frame.shape))
+        self.count = 0
+        self.info = list()
+
+    def append(self, frame: numpy.ndarray, frame_number=None, properties=None):
+        with self.__lock:
+            if self.__ram is None or self.__ram.shape[1:] != frame.shape or self.__ram.dtype != frame.dtype:
+                self.__allocate(frame)
+            slots = self.__ram.shape[0]
+            slot = self.count % slots
+            if self.count >= slots and self.__disk is not None:
+                older = self.count - slots
+                self.__disk[older % self.__disk.shape[0]] = self.__ram[slot]
+            self.__ram[slot] = frame
+            self.count += 1
+            self.info.append((time.time(), frame_number, properties))
+            del self.info[:-self.depth]
+
+    def __frame(self, index):
+        """Frame by its absolute index (0 the first appended), which must still be held."""
+        slots = self.__ram.shape[0]
+        if index >= self.count - slots:
+            return self.__ram[index % slots]
+        return self.__disk[index % self.__disk.shape[0]]
+
+    def __indices(self, start, stop):
+        first = self.count - len(self.info)
+        return [first + index for index in range(*slice(start, stop).indices(len(self.info)))]
+
+    def get(self, index: int) -> typing.Tuple[numpy.ndarray, typing.Tuple]:
+        """Returns a copy of a frame and its (time, frame number, frame parameters)."""
+        with self.__lock:
+            index = range(len(self.info))[index]
+            return numpy.array(self.__frame(self.count - len(self.info) + index)), self.info[index]
+
+    def __stack(self, start, stop):
+        indices = self.__indices(start, stop)
+        stack = numpy.empty((len(indices), *self.__ram.shape[1:]), self.__ram.dtype) if self.__ram is not None \
+            else numpy.empty((0,))
+        for position, index in enumerate(indices):
+            stack[position] = self.__frame(index)
+        return stack
+
+    def frames(self, start=None, stop=None) -> numpy.ndarray:
+        """Returns a copy of the frames start:stop, stacked along the first axis."""
+        with self.__lock:
+            return self.__stack(start, stop)
+
+    def average(self, start=None, stop=None) -> typing.Optional[numpy.ndarray]:
+        """Returns the float32 mean of the frames start:stop, or None if there are none."""
+        with self.__lock:
+            indices = self.__indices(start, stop)
+            if not indices:
+                return None
+            mean = numpy.zeros(self.__ram.shape[1:], numpy.float32)
+            for index in indices:
+                mean += self.__frame(index)
+            mean /= len(indices)
+            return mean
+
+    def export(self, path: str, start=None, stop=None):
+        """Saves the frames start:stop with their times, frame numbers and frame parameters (json) as a npz file."""
+        with self.__lock:  # frames and info of the same range
+            stack = self.__stack(start, stop)
+            info = self.info[slice(start, stop)]
+        numpy.savez(path, data=stack, times=numpy.array([item[0] for item in info]),
+                    frame_numbers=numpy.array([-1 if item[1] is None else item[1] for item in info]),
+                    parameters=numpy.array([json.dumps(item[2], default=str) for item in info]))
 
 
 class Device:
@@ -65,6 +304,17 @@ class Device:
         self.__frame_parameters = copy.deepcopy(self.__profiles[0])
         self.flyback_pixels = 2
         self.__buffer = list()
+        self.__scan_buffer = ScanBuffer()
+        self.__output = None  # detector frames delivered by read_partial, reused
+        self.averager = FrameAverager()
+        self.drift_tracker = DriftTracker()
+        self.drift_event = Event.Event()  # (frame number, (dy, dx) total drift in nm)
+        self.lines_averaging = 1
+        self.history_depth = 0  # frames kept per channel in frame_history, 0 for none
+        self.history_ram_mb = 256
+        self.frame_history = dict()  # channel id: ScanFrameRing
+        self.__updated = (None, 0)  # (DLL image number, last row updated + 1), from the unlocker rect
+        self.__completed_image = None
 
         self.orsayscan = orsayScan(1, vg=True)
         self.spimscan = orsayScan(2, self.orsayscan.orsayscan, vg=True)
@@ -125,7 +375,8 @@ class Device:
         #self.__is_scanning = False
 
     def __get_channels(self) -> typing.List[Channel]:
-        return [Channel(0, "ADF", True), Channel(1, "BF", False)]
+        return [Channel(0, "ADF", True), Channel(1, "BF", False),
+                Channel(2, "ADF Average", False, source=0), Channel(3, "BF Average", False, source=1)]
 
     def __get_initial_profiles(self) -> typing.List[scan_base.ScanFrameParameters]:
         profiles = list()
@@ -193,7 +444,11 @@ class Device:
             if not self.__spim:
                 #self.imagedata = numpy.empty((self.__sizez * (self.__scan_area[0]), (self.__scan_area[1])), dtype=numpy.int16)
                 #self.imagedata_ptr = self.imagedata.ctypes.data_as(ctypes.c_void_p)
-                self.__is_scanning = self.orsayscan.startImaging(0, 1)
+                self.averager.reset()
+                self.drift_tracker.reset()
+                self.__updated = (None, 0)  # the DLL numbers the images of every run from the start
+                self.__completed_image = None
+                self.__is_scanning = self.orsayscan.startImaging(0, self.lines_averaging)
 
             logging.info(f'**SCAN***: Acquisition Started is {self.__is_scanning}.')
         return self.__frame_number
@@ -205,9 +460,8 @@ class Device:
         size = Geometry.IntSize.make(
             frame_parameters.subscan_pixel_size if frame_parameters.subscan_pixel_size else frame_parameters.size)
         for channel in channels:
-            channel.data = numpy.zeros(tuple(size), numpy.float32)
-        self.__frame_number += 1
-        self.__frame = Frame(self.__frame_number, channels, frame_parameters)
+            channel.data = None  # allocated by read_partial, with the delivered geometry
+        self.__frame = Frame(None, channels, frame_parameters)  # numbered by the DLL image it is read from
 
     def read_partial(self, frame_number, pixels_to_skip) -> (typing.Sequence[dict], bool, bool, tuple, int, int):
         """Read or continue reading a frame.
@@ -224,6 +478,7 @@ class Device:
         """
 
         gotit = self.has_data_event.wait(1.0)
+        self.has_data_event.clear()
 
         if self.__frame is None:
             self.__start_next_frame()
@@ -232,42 +487,29 @@ class Device:
         assert current_frame is not None
         data_elements = list()
 
+        if not self.__spim and self.__is_scanning:
+            return self.__read_rows(current_frame, pixels_to_skip)
+
         for channel in current_frame.channels:  # At the end of the day this uses channel_id, which is a 0, 1 saying which channel is which
+            if channel.source is not None:
+                continue
             data_element = dict()
-            if not self.__spim and self.__is_scanning:
-                data_array = self.imagedata[channel.channel_id * (self.__scan_area[1]):(channel.channel_id + 1) * (
-                self.__scan_area[1]),
-                             0+1: (self.__scan_area[0]-1)].astype(numpy.uint16)
-                if self.subscan_status:  # Marcel programs returns 0 pixels without the sub scan region so i just crop
-                    data_array = data_array[self.p4:self.p5, self.p2:self.p3]
-                data_element["data"] = data_array
-                properties = current_frame.frame_parameters.as_dict()
-                properties["center_x_nm"] = current_frame.frame_parameters.center_nm[1]
-                properties["center_y_nm"] = current_frame.frame_parameters.center_nm[0]
-                properties["rotation_deg"] = math.degrees(current_frame.frame_parameters.rotation_rad)
-                properties["channel_id"] = channel.channel_id
-                data_element["properties"] = properties
-                if data_array is not None:
-                    data_elements.append(data_element)
-
-            else:
-                data_array = self.imagedata[channel.channel_id * (self.__scan_area[1]):channel.channel_id * (
-                    self.__scan_area[1]) + self.__spim_pixels[1],
-                             0: (self.__spim_pixels[0])].astype(numpy.float32)
-                #data_array = self.imagedata.astype(numpy.float32)
-                #if self.subscan_status:  # Marcel programs returns 0 pixels without the sub scan region so i just crop
-                #    data_array = data_array[self.p4:self.p5, self.p2:self.p3]
-                data_element["data"] = data_array
-                properties = current_frame.frame_parameters.as_dict()
-                properties["center_x_nm"] = current_frame.frame_parameters.center_nm[1]
-                properties["center_y_nm"] = current_frame.frame_parameters.center_nm[0]
-                properties["rotation_deg"] = math.degrees(current_frame.frame_parameters.rotation_rad)
-                properties["channel_id"] = channel.channel_id
-                data_element["properties"] = properties
-                if data_array is not None:
-                    data_elements.append(data_element)
-
-        self.has_data_event.clear()
+            # spim: the scan follows the camera clock, its image is sent whole
+            data_array = self.imagedata[channel.channel_id * (self.__scan_area[1]):channel.channel_id * (
+                self.__scan_area[1]) + self.__spim_pixels[1],
+                         0: (self.__spim_pixels[0])].astype(numpy.float32)
+            #data_array = self.imagedata.astype(numpy.float32)
+            #if self.subscan_status:  # Marcel programs returns 0 pixels without the sub scan region so i just crop
+            #    data_array = data_array[self.p4:self.p5, self.p2:self.p3]
+            data_element["data"] = data_array
+            properties = current_frame.frame_parameters.as_dict()
+            properties["center_x_nm"] = current_frame.frame_parameters.center_nm[1]
+            properties["center_y_nm"] = current_frame.frame_parameters.center_nm[0]
+            properties["rotation_deg"] = math.degrees(current_frame.frame_parameters.rotation_rad)
+            properties["channel_id"] = channel.channel_id
+            data_element["properties"] = properties
+            if data_array is not None:
+                data_elements.append(data_element)
 
         current_frame.complete = True
         if current_frame.complete:
@@ -276,6 +518,126 @@ class Device:
         # return data_elements, complete, bad_frame, sub_area, frame_number, pixels_to_skip
         return data_elements, True, False, ((0, 0), data_array.shape), None, 0
 
+    def __read_rows(self, current_frame: Frame, pixels_to_skip: int):
+        """
+        Imaging read: only the rows updated since pixels_to_skip (as reported by the unlocker rect) are converted from
+        the DLL buffer into the frame arrays. The detector arrays are views of one output reused from frame to frame,
+        which is fine as the data elements are copied before the next read. The frame is complete when its last row is
+        there, or when the DLL has gone on to the next image. In that last case the rows not read yet are taken as they
+        are, and the top ones may already belong to the next image (torn frame). This happens when a frame is shorter
+        than the read period. The frame is still delivered, because dropping it would freeze fast scans.
+        """
+        planes = self.imagedata.reshape(self.__sizez, self.__scan_area[1], self.__scan_area[0])
+        top, left, right = 0, 1, self.__scan_area[0] - 1  # first and last columns are not delivered
+        height = self.__scan_area[1]
+        if self.subscan_status:  # Marcel programs returns 0 pixels without the sub scan region so i just crop
+            top, height = self.p4, self.p5 - self.p4
+            left, right = left + self.p2, min(left + self.p3, right)
+        width = right - left
+
+        image, last_row = self.__updated
+        if current_frame.image_number is None and image is not None:
+            # after a frame whose last row was delivered, wait for the next image
+            current_frame.image_number = image + 1 if image == self.__completed_image else image
+            current_frame.frame_number = self.__frame_number = current_frame.image_number
+        if image is None or image < current_frame.image_number:
+            last_row = top
+        elif image > current_frame.image_number:
+            last_row = top + height
+        start = min(pixels_to_skip // width, height) if width > 0 else 0
+        stop = min(max(last_row - top, start), height)
+
+        current_frame.complete = stop >= height
+        detectors = {channel.channel_id: channel for channel in current_frame.channels if channel.source is None}
+        ids = sorted(detectors)
+        if self.__output is None or self.__output.shape != (len(ids), height, width):
+            self.__output = numpy.empty((len(ids), height, width), numpy.uint16)
+        if ids and stop > start:  # every detector converted by one cast, from a view when their planes follow
+            planes_slice = slice(ids[0], ids[-1] + 1) if ids[-1] - ids[0] == len(ids) - 1 else ids
+            numpy.copyto(self.__output[:, start:stop], planes[planes_slice, top + start:top + stop, left:right],
+                         casting="unsafe")
+        averaged = list()
+        data_elements = list()
+        for channel in current_frame.channels:
+            if channel.source is not None:
+                if self.averager.mode == FrameAverager.NONE:
+                    continue
+                if current_frame.complete:
+                    detector = detectors.get(channel.source)
+                    frame = detector.data if detector is not None else \
+                        planes[channel.source, top:top + height, left:right]
+                    channel.data = self.averager.add(channel.source, frame)
+                else:
+                    channel.data = self.averager.result(channel.source)
+                if channel.data is None or channel.data.shape != (height, width):
+                    channel.data = numpy.zeros((height, width), numpy.float32)
+                averaged.append(channel)
+            elif channel.data is None:
+                channel.data = self.__output[ids.index(channel.channel_id)]
+            properties = current_frame.frame_parameters.as_dict()
+            properties["center_x_nm"] = current_frame.frame_parameters.center_nm[1]
+            properties["center_y_nm"] = current_frame.frame_parameters.center_nm[0]
+            properties["rotation_deg"] = math.degrees(current_frame.frame_parameters.rotation_rad)
+            properties["channel_id"] = channel.channel_id
+            if channel.source is not None:
+                properties["averaging"] = ("recursive", "block")[self.averager.mode - 1]
+                properties["averaging_frames"] = self.averager.frames
+            data_elements.append({"data": channel.data, "properties": properties})
+
+        if averaged and current_frame.complete:  # averages change everywhere, send the whole frame
+            start = 0
+        if current_frame.complete and self.drift_tracker.enabled:
+            detector = detectors.get(0)
+            drift_nm = self.__track_drift(current_frame, detector.data if detector is not None else
+                                          planes[0, top:top + height, left:right])
+            for data_element in data_elements:
+                data_element["properties"]["drift_nm"] = drift_nm
+        if current_frame.complete and self.history_depth > 0:
+            self.__keep_frame(current_frame)
+        if current_frame.complete:
+            self.__completed_image = current_frame.image_number
+            self.__frame = None
+
+        # return data_elements, complete, bad_frame, sub_area, frame_number, pixels_to_skip
+        return data_elements, current_frame.complete, False, ((start, 0), (stop - start, width)), \
+            current_frame.frame_number, stop * width
+
+    def __keep_frame(self, current_frame: Frame):
+        properties = current_frame.frame_parameters.as_dict()
+        for channel in current_frame.channels:
+            if channel.source is not None or channel.data is None:
+                continue
+            ring = self.frame_history.get(channel.channel_id)
+            if ring is None or (ring.depth, ring.ram_mb) != (self.history_depth, self.history_ram_mb):
+                ring = self.frame_history[channel.channel_id] = ScanFrameRing(self.history_depth, self.history_ram_mb)
+            ring.append(channel.data, current_frame.frame_number, properties)
+
+    def __track_drift(self, current_frame: Frame, frame: numpy.ndarray):
+        """
+        Measures the drift of a complete ADF frame. With correction on, a subscan window is moved by the whole pixels
+        of the drift (within the full frame) before the next frame, so the image follows the specimen.
+        """
+        dy, dx = self.drift_tracker.measure(frame, current_frame.frame_number)
+        total = self.drift_tracker.history[-1][2:]
+        pixel_nm = current_frame.frame_parameters.fov_nm / max(self.p0, self.p1)
+        drift_nm = (total[0] * pixel_nm, total[1] * pixel_nm)
+        self.drift_event.fire(current_frame.frame_number, drift_nm)
+        if not (self.drift_tracker.correct and self.subscan_status):
+            return drift_nm
+        step_y = int(numpy.clip(round(dy), -self.p4, self.p1 - self.p5))
+        step_x = int(numpy.clip(round(dx), -self.p2, self.p0 - self.p3))
+        if step_x or step_y:
+            self.p2, self.p3, self.p4, self.p5 = self.p2 + step_x, self.p3 + step_x, self.p4 + step_y, self.p5 + step_y
+            offset = self.drift_tracker.offset
+            self.drift_tracker.offset = (offset[0] + step_y, offset[1] + step_x)
+            self.Image_area = [self.p0, self.p1, self.p2, self.p3, self.p4, self.p5]
+        return drift_nm
+
+    @property
+    def drift_history(self) -> typing.List[typing.Tuple[float, int, float, float]]:
+        """(time, frame number, dy, dx) drift since the tracking reference, in pixels."""
+        return list(self.drift_tracker.history)
+
     #This one is called in scan_base
     def prepare_synchronized_scan(self, scan_frame_parameters: scan_base.ScanFrameParameters, *, camera_exposure_ms, **kwargs) -> None:
         #scan_frame_parameters["pixel_time_us"] = min(5120000, int(1000 * camera_exposure_ms * 0.75))
@@ -334,8 +696,11 @@ class Device:
         self.__scan_area = value
         self.orsayscan.setImageArea(self.__scan_area[0], self.__scan_area[1], self.__scan_area[2], self.__scan_area[3],
                                     self.__scan_area[4], self.__scan_area[5])
-        self.imagedata = numpy.empty((self.__sizez * (self.__scan_area[0]), (self.__scan_area[1])), dtype=numpy.int16)
-        self.imagedata_ptr = self.imagedata.ctypes.data_as(ctypes.c_void_p)
+        self.__update_buffer()
+
+    def __update_buffer(self):
+        self.imagedata = self.__scan_buffer.view(self.__sizez, self.__scan_area[0], self.__scan_area[1])
+        self.imagedata_ptr = self.__scan_buffer.pointer
 
     @property
     def probe_pos(self):
@@ -392,9 +757,11 @@ class Device:
             elif self.__instrument.spim_trigger_f==1:
                 self.spimscan.setScanClock(4)
                 logging.info(f'***SCAN***: Cathodoluminescence Spim')
+            elif self.__instrument.spim_trigger_f==2:
+                self.spimscan.setScanClock(self.__instrument.spim_scan_clock_f)
+                logging.info(f'***SCAN***: EELS and Cathodoluminescence Spim')
 
-            self.imagedata = numpy.empty((self.__sizez * (self.__scan_area[0]), (self.__scan_area[1])), dtype=numpy.int16)
-            self.imagedata_ptr = self.imagedata.ctypes.data_as(ctypes.c_void_p)
+            self.__update_buffer()
             self.spimscan.startSpim(0, 1)
 
         else:
@@ -404,7 +771,7 @@ class Device:
 
             pmts=[]
             for counter, value in enumerate(self.channels_enabled):
-                if value: pmts.append(counter)
+                if value and self.__channels[counter].source is None: pmts.append(counter)
             self.__instrument.warn_Scan_instrument_spim_over(self.imagedata, self.__spim_pixels, pmts)
 
 
@@ -431,7 +798,8 @@ class Device:
 
     def __data_unlockerA(self, gene, newdata, imagenb, rect):
         if newdata:
-            self.__frame_number = imagenb
+            # rect: x, y, width, height of the area just written, rows before y + height are up to date
+            self.__updated = (imagenb, rect[1] + rect[3])
             self.has_data_event.set()
 
     def show_configuration_dialog(self, api_broker) -> None:
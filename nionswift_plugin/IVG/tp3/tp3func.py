@@ -9,6 +9,8 @@ import struct
 import pathlib
 import os
 import select
+import multiprocessing
+from multiprocessing import shared_memory
 
 from nion.swift.model import HardwareSource
 #from swift_rust.target.release import rust2swift
@@ -23,6 +25,152 @@ class Response():
 
 
 SAVE_FILE = False
+SPIM_CHANNELS = 1025  # Channels per pixel in the event indexes sent by the TP3 client
+FRAME_SLOTS = 4  # Frames kept in shared memory by the ingestion process
+FRAME_SLOT_SIZE = 1024 * 256 * 4 + 1  # Largest frame (32 bits) plus the trailing byte
+
+
+def remap_energy_events(event_list, start, end, binning, channels):
+    """
+    Crops the events to the energy channels [start, end) and bins them by an integer factor. Returned indexes are
+    pixel * channels + binned channel, where channels is the number of channels in the cropped and binned SPIM.
+    """
+    event_list = event_list.astype(numpy.uint32)
+    channel = event_list % SPIM_CHANNELS
+    inside = (channel >= start) & (channel < end)
+    return (event_list[inside] // SPIM_CHANNELS) * channels + (channel[inside] - start) // binning
+
+
+def assign_scan_frames(pixels, last_pixel, frame, pixel_count):
+    """
+    Gives a scan frame index to every event in pixels. Events arrive in scan order, so a new frame begins every time
+    the pixel index jumps backwards by more than half of the scan. last_pixel and frame are the values at the end of
+    the previous chunk.
+    """
+    previous = numpy.empty_like(pixels)
+    previous[0] = last_pixel
+    previous[1:] = pixels[:-1]
+    return frame + numpy.cumsum((pixels - previous) < -(pixel_count // 2))
+
+
+def estimate_frame_shifts(images):
+    """
+    Estimates the integer (y, x) shift of each image in the stack with respect to the first one using the peak of the
+    FFT cross-correlation.
+    """
+    nframes, height, width = images.shape
+    images = images - images.mean(axis=(1, 2), keepdims=True)
+    ft = numpy.fft.rfft2(images)
+    xcorr = numpy.fft.irfft2(ft * numpy.conj(ft[0]), s=(height, width))
+    dy, dx = numpy.unravel_index(xcorr.reshape(nframes, -1).argmax(axis=1), (height, width))
+    dy = numpy.where(dy > height // 2, dy - height, dy)
+    dx = numpy.where(dx > width // 2, dx - width, dx)
+    return dy, dx
+
+
+def drift_corrected_spim(events, frames, xspim, yspim, channels):
+    """
+    Re-accumulates the SPIM from events tagged with their scan frame. A count image is built for every frame, its shift
+    is estimated by cross-correlation and every event is moved back by the shift of its frame. Events that fall out of
+    the scan are dropped. Returns the flat cube and the shifts.
+    """
+    pixels = (events // channels).astype(numpy.int64)
+    channel = events % channels
+    nframes = int(frames.max()) + 1
+    images = numpy.bincount(frames * (xspim * yspim) + pixels, minlength=nframes * xspim * yspim)
+    images = images.reshape((nframes, yspim, xspim)).astype(numpy.float32)
+    dy, dx = estimate_frame_shifts(images)
+    y = pixels // xspim - dy[frames]
+    x = pixels % xspim - dx[frames]
+    inside = (y >= 0) & (y < yspim) & (x >= 0) & (x < xspim)
+    index = (y * xspim + x)[inside] * channels + channel[inside]
+    spim = numpy.bincount(index, minlength=xspim * yspim * channels).astype(numpy.uint32)
+    return spim, dy, dx
+
+
+def check_string_value(header, prop):
+    """
+    Check the value in the header dictionary. Some values are not number so a valueError
+    exception handles this.
+    """
+
+    start_index = header.index(prop)
+    end_index = start_index + len(prop)
+    begin_value = header.index(':', end_index, len(header)) + 1
+    if prop == 'height':
+        end_value = header.index('}', end_index, len(header))
+    else:
+        end_value = header.index(',', end_index, len(header))
+    try:
+        if prop == 'timeAtFrame':
+            value = float(header[begin_value:end_value])
+        else:
+            value = int(header[begin_value:end_value])
+    except ValueError:
+        value = str(header[begin_value:end_value])
+    return value
+
+
+def check_frame_size(cam_properties, frame):
+    """
+    True if the frame received has the size announced in its header.
+    """
+    return int(cam_properties['width']) * int(cam_properties['height']) * int(cam_properties['bitDepth'] / 8) == \
+        int(cam_properties['dataSize']) and cam_properties['dataSize'] + 1 == len(frame)
+
+
+class SpimAccumulator():
+    """
+    Accumulates SPIM events in a flat uint32 cube. Events are cropped and binned in energy and, if drift correction is
+    on, kept together with their scan frame. Used both by the client Thread and by the ingestion process.
+    """
+
+    def __init__(self, cube, xspim, yspim, energy_roi, energy_binning, drift):
+        self.cube = cube
+        self.xspim = xspim
+        self.yspim = yspim
+        self.energy_roi = energy_roi
+        self.energy_binning = energy_binning
+        self.channels = -(-(energy_roi[1] - energy_roi[0]) // energy_binning)
+        self.drift = drift
+        self.shifts = None
+        self.__events = list()
+        self.__frames = list()
+        self.__last_pixel = 0
+        self.__frame = 0
+
+    def add(self, event_list):
+        """
+        Adds the events to the SPIM. Events are first cropped and binned in energy if needed.
+        """
+        if self.channels != SPIM_CHANNELS:
+            event_list = remap_energy_events(event_list, *self.energy_roi, self.energy_binning, self.channels)
+        unique, counts = numpy.unique(event_list, return_counts=True)
+        counts = counts.astype(numpy.uint32)
+        self.cube[unique] += counts
+        if self.drift and len(event_list):
+            event_list = event_list.astype(numpy.uint32)
+            pixels = (event_list // self.channels).astype(numpy.int64)
+            frames = assign_scan_frames(pixels, self.__last_pixel, self.__frame, self.xspim * self.yspim)
+            self.__last_pixel = pixels[-1]
+            self.__frame = frames[-1]
+            self.__events.append(event_list)
+            self.__frames.append(frames.astype(numpy.uint32))
+
+    def correct_drift(self):
+        """
+        Replaces, in place, the cube by the drift corrected one. Returns True if it was done.
+        """
+        if not self.__events:
+            return False
+        events = numpy.concatenate(self.__events)
+        frames = numpy.concatenate(self.__frames).astype(numpy.int64)
+        self.__events = list()
+        self.__frames = list()
+        spim, dy, dx = drift_corrected_spim(events, frames, self.xspim, self.yspim, self.channels)
+        self.cube[:] = spim
+        self.shifts = (dy, dx)
+        return True
 
 
 class TimePix3():
@@ -44,6 +192,16 @@ class TimePix3():
         self.__width = 0.
         self.__tdc = 0  # Beginning of line n and beginning of line n+1
         self.__tp3mode = 0
+        self.__energyRoi = (0, SPIM_CHANNELS)
+        self.__energyBinning = 1
+        self.__spimChannels = SPIM_CHANNELS
+        self.__driftCorrection = False
+        self.__driftShifts = None
+        self.__accumulator = None
+        self.__ingestProcess = False
+        self.__process = None
+        self.__sharedMemory = None
+        self.__freeSlots = None
         self.__filepath = os.path.join(pathlib.Path(__file__).parent.absolute(), "data")
         self.__simul = simul
         self.sendmessage = message
@@ -407,6 +565,48 @@ class TimePix3():
     def setTp3Mode(self, mode):
         self.__tp3mode = mode
 
+    def setEnergyRoi(self, start, end):
+        """
+        Energy channels [start, end) kept in the SPIM. Other events are dropped at ingestion.
+        """
+        start = max(0, int(start))
+        end = min(SPIM_CHANNELS, int(end))
+        if end <= start:
+            logging.info(f'***TP3***: Invalid energy ROI ({start}, {end}). Using all channels.')
+            start, end = 0, SPIM_CHANNELS
+        self.__energyRoi = (start, end)
+
+    def setEnergyBinning(self, binning):
+        """
+        Integer number of energy channels summed together in the SPIM.
+        """
+        self.__energyBinning = max(1, int(binning))
+
+    def getSpimChannels(self):
+        """
+        Returns the number of energy channels in the SPIM given the energy ROI and binning.
+        """
+        start, end = self.__energyRoi
+        return -(-(end - start) // self.__energyBinning)
+
+    def setDriftCorrection(self, value):
+        """
+        If True, SPIM events keep their scan frame index so drift between repeated frames is corrected at the end.
+        """
+        self.__driftCorrection = bool(value)
+
+    def setIngestProcess(self, value):
+        """
+        If True, the client (connection, decoding and accumulation) runs in a separate process.
+        """
+        self.__ingestProcess = bool(value)
+
+    def getDriftShifts(self):
+        """
+        Returns the (y, x) shifts in pixels of every scan frame of the last drift corrected SPIM, or None.
+        """
+        return self.__driftShifts
+
     def getNumofSpeeds(self, cameraport):
         pass
 
@@ -531,11 +731,15 @@ class TimePix3():
 
     def start_listening(self, port=8088, message=1, spim=1):
         """
-        Starts the client Thread and sets isPlaying to True.
+        Starts the client Thread and sets isPlaying to True. If ingestion process is on, the client runs in a separate
+        process instead and the Thread only listens to its notifications.
         """
         self.__isPlaying = True
-        self.__clientThread = threading.Thread(target=self.acquire_streamed_frame, args=(port, message, spim,))
-        self.__clientThread.start()
+        if self.__ingestProcess:
+            self.start_ingest_process(port, message, spim)
+        else:
+            self.__clientThread = threading.Thread(target=self.acquire_streamed_frame, args=(port, message, spim,))
+            self.__clientThread.start()
 
     def finish_listening(self):
         """
@@ -543,33 +747,17 @@ class TimePix3():
         """
         if self.__isPlaying:
             self.__isPlaying = False
-            self.__clientThread.join()
+            if self.__process is not None:
+                self.finish_ingest_process()
+            else:
+                self.__clientThread.join()
             logging.info(f'***TP3***: Stopping acquisition. There was {self.__dataQueue.qsize()} items in the Queue.')
             logging.info(
                 f'***TP3***: Stopping acquisition. There was {self.__eventQueue.qsize()} electron events in the Queue.')
             self.__dataQueue = queue.LifoQueue()
             self.__eventQueue = queue.Queue()
 
-    def acquire_streamed_frame(self, port, message, spim):
-        """
-        Main client function. Main loop is explained below.
-
-        Client is a socket connected to camera in host computer 129.175.108.52. Port depends on which kind of data you
-        are listening on. After connection, timeout is set to 5 ms, which is camera current dead time. cam_properties
-        is a dict containing all info camera sends through tcp (the header); frame_data is the frame; buffer_size is how
-        many bytes we collect within each loop interaction; frame_number is the frame counter and frame_time is when the
-        whole frame began.
-
-        check string value is a convenient function to detect the values using the header standard format for jsonimage.
-        """
-        inputs = list()
-        outputs = list()
-        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_aux = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        #if self.__simul:
-        client_aux.bind(("127.0.0.1", 9088))
-        #else:
-        #    client_aux.bind(("192.168.199.10", 9088))
+    def client_address(self, port):
         """
         127.0.0.1 -> LocalHost;
         129.175.108.58 -> Patrick;
@@ -579,18 +767,28 @@ class TimePix3():
         129.175.108.52 -> CheeTah
         """
         ip = socket.gethostbyname('127.0.0.1') if self.__simul else socket.gethostbyname('192.168.199.11')
-        address = (ip, port)
-        try:
-            client.connect(address)
-            logging.info(f'***TP3***: Both clients connected over {ip}:{port}.')
-            inputs.append(client)
-            inputs.append(client_aux)
-        except ConnectionRefusedError:
-            return False
+        return (ip, port)
 
-        cam_properties = dict()
-        buffer_size = 64000
+    def new_spim(self, spim, buffer=None):
+        """
+        Creates the SPIM cube (in buffer if given, for example a shared memory) and its accumulator.
+        """
+        self.__spimChannels = self.getSpimChannels()
+        self.__xspim = int(numpy.sqrt(spim))
+        self.__yspim = int(numpy.sqrt(spim))
+        self.__driftShifts = None
+        if buffer is None:
+            self.__spimData = numpy.zeros(spim * self.__spimChannels, dtype=numpy.uint32)
+        else:
+            self.__spimData = numpy.ndarray((spim * self.__spimChannels,), dtype=numpy.uint32, buffer=buffer)
+            self.__spimData[:] = 0
+        self.__accumulator = SpimAccumulator(self.__spimData, self.__xspim, self.__yspim, self.__energyRoi,
+                                             self.__energyBinning, self.__driftCorrection)
 
+    def config_bytes(self, message):
+        """
+        Builds the configuration sent to the client after connection. For SPIM, new_spim must have been called before.
+        """
         config_bytes = b''
 
         self.__tr = False  # Start always with false and will be updated if otherwise
@@ -617,10 +815,6 @@ class TimePix3():
             config_bytes += size.to_bytes(2, 'big')
 
         elif message == 2:
-            self.__spimData = numpy.zeros(spim * 1025, dtype=numpy.uint32)
-            self.__xspim = int(numpy.sqrt(spim))
-            self.__yspim = int(numpy.sqrt(spim))
-
             if self.__tp3mode == 3:  # Time Resolved SPIM
                 if not self.__simul:
                     scanInstrument = HardwareSource.HardwareSourceManager().get_hardware_source_for_hardware_source_id(
@@ -638,7 +832,6 @@ class TimePix3():
 
             config_bytes += self.__xspim.to_bytes(2, 'big')
             config_bytes += self.__yspim.to_bytes(2, 'big')
-            self.sendmessage(message)
 
         if not self.__simul:
             scanInstrument = HardwareSource.HardwareSourceManager().get_hardware_source_for_hardware_source_id(
@@ -657,41 +850,54 @@ class TimePix3():
 
         config_bytes += struct.pack(">d", self.__delay)  # BE. See https://docs.python.org/3/library/struct.html
         config_bytes += struct.pack(">d", self.__width)  # BE. See https://docs.python.org/3/library/struct.html
+        return config_bytes
 
-        client.send(config_bytes)
+    def acquire_streamed_frame(self, port, message, spim):
+        """
+        Main client function. Main loop is explained below.
 
-        def check_string_value(header, prop):
-            """
-            Check the value in the header dictionary. Some values are not number so a valueError
-            exception handles this.
-            """
-
-            start_index = header.index(prop)
-            end_index = start_index + len(prop)
-            begin_value = header.index(':', end_index, len(header)) + 1
-            if prop == 'height':
-                end_value = header.index('}', end_index, len(header))
-            else:
-                end_value = header.index(',', end_index, len(header))
-            try:
-                if prop == 'timeAtFrame':
-                    value = float(header[begin_value:end_value])
-                else:
-                    value = int(header[begin_value:end_value])
-            except ValueError:
-                value = str(header[begin_value:end_value])
-            return value
+        Client is a socket connected to camera in host computer 129.175.108.52. Port depends on which kind of data you
+        are listening on. After connection, timeout is set to 5 ms, which is camera current dead time. cam_properties
+        is a dict containing all info camera sends through tcp (the header); frame_data is the frame; buffer_size is how
+        many bytes we collect within each loop interaction; frame_number is the frame counter and frame_time is when the
+        whole frame began.
+
+        check string value is a convenient function to detect the values using the header standard format for jsonimage.
+        """
+        inputs = list()
+        outputs = list()
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client_aux = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        #if self.__simul:
+        client_aux.bind(("127.0.0.1", 9088))
+        #else:
+        #    client_aux.bind(("192.168.199.10", 9088))
+        address = self.client_address(port)
+        try:
+            client.connect(address)
+            logging.info(f'***TP3***: Both clients connected over {address[0]}:{port}.')
+            inputs.append(client)
+            inputs.append(client_aux)
+        except ConnectionRefusedError:
+            return False
+
+        cam_properties = dict()
+        buffer_size = 64000
+
+        if message == 2:
+            self.new_spim(spim)
+        config_bytes = self.config_bytes(message)
+        if message == 2:
+            self.sendmessage(message)
+
+        client.send(config_bytes)
 
         def put_queue(cam_prop, frame):
-            try:
-                assert int(cam_properties['width']) * int(
-                    cam_properties['height']) * int(
-                    cam_properties['bitDepth'] / 8) == int(cam_properties['dataSize'])
-                assert cam_properties['dataSize'] + 1 == len(frame)
+            if check_frame_size(cam_prop, frame):
                 self.__dataQueue.put((cam_prop, frame))
                 self.sendmessage(message)
                 return True
-            except AssertionError:
+            else:
                 logging.info(
                     f'***TP3***: Problem in size/len assertion. Properties are {cam_properties} and data is {len(frame)}')
                 return False
@@ -777,6 +983,84 @@ class TimePix3():
                     return
         return
 
+    def start_ingest_process(self, port, message, spim):
+        """
+        Runs the whole client (connection, decoding and accumulation) in a separate process so it does not share the
+        GIL with Swift. The SPIM cube (message=2) or the last frames (message=1) live in shared memory and the process
+        only sends small notifications, which are handled by listen_ingest_process in a Thread.
+        """
+        address = self.client_address(port)
+        self.__notifications = multiprocessing.Queue()
+        self.__stopIngest = multiprocessing.Event()
+        if message == 1:
+            self.__sharedMemory = shared_memory.SharedMemory(create=True, size=FRAME_SLOTS * FRAME_SLOT_SIZE)
+            self.__freeSlots = multiprocessing.Semaphore(FRAME_SLOTS)  # released by the listener once copied
+            config_bytes = self.config_bytes(message)
+            kwargs = {'frame_name': self.__sharedMemory.name, 'free_slots': self.__freeSlots}
+        else:
+            cube_size = spim * self.getSpimChannels()
+            self.__sharedMemory = shared_memory.SharedMemory(create=True, size=cube_size * 4)
+            self.new_spim(spim, buffer=self.__sharedMemory.buf)
+            config_bytes = self.config_bytes(message)
+            self.sendmessage(message)
+            kwargs = {'spim_name': self.__sharedMemory.name, 'spim_size': cube_size, 'xspim': self.__xspim,
+                      'yspim': self.__yspim, 'energy_roi': self.__energyRoi, 'energy_binning': self.__energyBinning,
+                      'drift': self.__driftCorrection}
+        self.__process = multiprocessing.Process(target=ingest_worker, args=(address, config_bytes, message,
+                                                                             self.__notifications, self.__stopIngest),
+                                                 kwargs=kwargs, daemon=True)
+        self.__process.start()
+        logging.info(f'***TP3***: Ingestion process started (pid {self.__process.pid}).')
+        self.__clientThread = threading.Thread(target=self.listen_ingest_process, args=(message,))
+        self.__clientThread.start()
+
+    def listen_ingest_process(self, message):
+        """
+        Handles the notifications of the ingestion process until it ends.
+        """
+        while True:
+            try:
+                notification = self.__notifications.get(timeout=1.0)
+            except queue.Empty:
+                if not self.__process.is_alive():
+                    return
+                continue
+            if notification[0] == 'frame':
+                cam_properties, slot, size = notification[1:]
+                begin = slot * FRAME_SLOT_SIZE
+                self.__dataQueue.put((cam_properties, bytes(self.__sharedMemory.buf[begin:begin + size])))
+                self.__freeSlots.release()
+                self.sendmessage(message)
+            elif notification[0] == 'drift':
+                self.__driftShifts = notification[1:]
+                logging.info(f'***TP3***: Drift corrected over {len(self.__driftShifts[0])} frames.')
+                self.sendmessage(4)
+            elif notification[0] == 'log':
+                logging.info(notification[1])
+            elif notification[0] == 'end':
+                return
+
+    def finish_ingest_process(self):
+        """
+        Stops the ingestion process and releases the shared memory. The SPIM is first copied out of it so it remains
+        available after the acquisition, and the camera is told (message 5) to drop its views of the shared cube so
+        the memory can be closed.
+        """
+        self.__stopIngest.set()
+        self.__process.join()
+        self.__clientThread.join()
+        self.__process = None
+        if self.__spimData is not None and self.__spimData.base is not None:
+            self.__spimData = numpy.array(self.__spimData)
+            self.__accumulator = None
+            self.sendmessage(5)
+        try:
+            self.__sharedMemory.close()
+        except BufferError:
+            logging.info('***TP3***: Shared memory still in use, it is closed when the last view is released.')
+        self.__sharedMemory.unlink()
+        self.__sharedMemory = None
+
     def get_last_data(self):
         return self.__dataQueue.get()
 
@@ -785,9 +1069,7 @@ class TimePix3():
 
     def update_spim(self):
         event_list = self.__eventQueue.get()
-        unique, counts = numpy.unique(event_list, return_counts=True)
-        counts = counts.astype(numpy.uint32)
-        self.__spimData[unique] += counts
+        self.__accumulator.add(event_list)
 
     def update_spim_all(self):
         logging.info('***TP3***: Emptying queue and closing connection.')
@@ -796,9 +1078,11 @@ class TimePix3():
             if qs % 100 == 0:
                 logging.info(f'***TP3***: Approximate points left: {qs}')
             event_list = self.__eventQueue.get()
-            unique, counts = numpy.unique(event_list, return_counts=True)
-            counts = counts.astype(numpy.uint32)
-            self.__spimData[unique] += counts
+            self.__accumulator.add(event_list)
+        if self.__accumulator.correct_drift():
+            self.__driftShifts = self.__accumulator.shifts
+            logging.info(f'***TP3***: Drift corrected over {len(self.__driftShifts[0])} frames.')
+            self.sendmessage(4)
         logging.info('***TP3***: SPIM finished.')
 
     def get_total_counts_from_data(self, frame_int):
@@ -857,4 +1141,98 @@ class TimePix3():
         return frame_int
 
     def create_spimimage_from_events(self):
-        return self.__spimData.reshape((self.__xspim, self.__yspim, 1025))
+        return self.__spimData.reshape((self.__xspim, self.__yspim,
+                                              self.__spimChannels))
+
+
+def ingest_worker(address, config_bytes, message, notifications, stop_event, frame_name=None, spim_name=None,
+                  spim_size=0, xspim=0, yspim=0, energy_roi=(0, SPIM_CHANNELS), energy_binning=1, drift=False,
+                  free_slots=None):
+    """
+    Client of the ingestion process. Same protocol as TimePix3.acquire_streamed_frame, but frames are written in
+    rotating slots of a shared memory and events are accumulated directly in the shared SPIM cube. A slot is only
+    written when free_slots can be acquired (the listener releases it once copied), otherwise the frame is dropped.
+    Notifications are tuples ('frame', properties, slot, size), ('drift', dy, dx), ('log', text) and ('end',).
+    """
+    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        client.connect(address)
+    except ConnectionRefusedError:
+        notifications.put(('log', f'***TP3***: Ingestion process could not connect to {address[0]}:{address[1]}.'))
+        notifications.put(('end',))
+        return
+    client.send(config_bytes)
+    shm = shared_memory.SharedMemory(name=frame_name if message == 1 else spim_name)
+    buffer_size = 64000
+    dropped = 0
+    try:
+        if message == 1:
+            slot = 0
+            while not stop_event.is_set():
+                read, _, _ = select.select([client], [], [], 0.1)
+                if not read:
+                    continue
+                packet_data = client.recv(buffer_size)
+                if packet_data == b'': return
+                while (packet_data.find(b'{"time') == -1) or (packet_data.find(b'}\n') == -1):
+                    temp = client.recv(buffer_size)
+                    if temp == b'': return
+                    packet_data += temp
+
+                begin_header = packet_data.index(b'{"time')
+                end_header = packet_data.index(b'}\n', begin_header)
+                header = packet_data[begin_header:end_header + 1].decode('latin-1')
+                cam_properties = dict()
+                for properties in ["timeAtFrame", "frameNumber", "measurementID", "dataSize", "bitDepth", "width",
+                                   "height"]:
+                    cam_properties[properties] = (check_string_value(header, properties))
+
+                data_size = int(cam_properties['dataSize'])
+
+                while len(packet_data) < begin_header + data_size + len(header):
+                    temp = client.recv(buffer_size)
+                    if temp == b'': return
+                    packet_data += temp
+
+                frame_data = packet_data[end_header + 2:end_header + 2 + data_size + 1]
+                if check_frame_size(cam_properties, frame_data) and len(frame_data) <= FRAME_SLOT_SIZE:
+                    if not free_slots.acquire(block=False):  # display behind, every slot is still to be copied
+                        dropped += 1
+                        continue
+                    begin = slot * FRAME_SLOT_SIZE
+                    shm.buf[begin:begin + len(frame_data)] = frame_data
+                    notifications.put(('frame', cam_properties, slot, len(frame_data)))
+                    slot = (slot + 1) % FRAME_SLOTS
+                else:
+                    notifications.put(('log', f'***TP3***: Problem in size/len assertion. Properties are '
+                                              f'{cam_properties} and data is {len(frame_data)}'))
+
+        elif message == 2:
+            cube = numpy.ndarray((spim_size,), dtype=numpy.uint32, buffer=shm.buf)
+            accumulator = SpimAccumulator(cube, xspim, yspim, energy_roi, energy_binning, drift)
+            dt = numpy.dtype(numpy.uint32).newbyteorder('>')
+            remainder = b''
+            while not stop_event.is_set():
+                read, _, _ = select.select([client], [], [], 0.1)
+                if not read:
+                    continue
+                packet_data = client.recv(buffer_size)
+                if packet_data == b'':
+                    notifications.put(('log', '***TP3***: No more packets received in SPIM.'))
+                    break
+                packet_data = remainder + packet_data
+                usable = len(packet_data) - len(packet_data) % 4
+                remainder = packet_data[usable:]
+                accumulator.add(numpy.frombuffer(packet_data[:usable], dtype=dt))
+            if accumulator.correct_drift():
+                notifications.put(('drift', *accumulator.shifts))
+            del cube, accumulator
+
+    except ConnectionResetError:
+        notifications.put(('log', '***TP3***: Socket reseted. Closing connection.'))
+    finally:
+        client.close()
+        shm.close()
+        if dropped:
+            notifications.put(('log', f'***TP3***: {dropped} frames dropped, the display was behind.'))
+        notifications.put(('end',))